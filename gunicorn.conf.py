@@ -0,0 +1,18 @@
+import os
+
+bind = os.environ.get("WBC_BIND", "0.0.0.0:5000")
+# Each worker is a separate process with its own job threads and loaded
+# models. Socket.IO clients use the websocket transport, so they need no
+# sticky sessions, but with more than one worker WBC_SOCKETIO_MESSAGE_QUEUE
+# must point to a message queue (e.g. redis://) for progress events to reach
+# clients connected to other workers.
+workers = int(os.environ.get("WBC_WORKERS", 1))
+worker_class = "gthread"
+threads = int(os.environ.get("WBC_THREADS", 32))
+timeout = int(os.environ.get("WBC_TIMEOUT", 120))
+graceful_timeout = 30
+keepalive = 5
+accesslog = "-"
+# The app starts job threads and may start inference processes, which must
+# not be inherited through fork, so every worker creates its own app.
+preload_app = False
@@ -1,6 +1,22 @@
-from website import create_app, socket
+import os
 
-app = create_app()
+from website import create_app, socket, start_warm_up
+from website.jobs import job_workers
 
+# Development server (Werkzeug); production runs wsgi:app under gunicorn.
+# Inference worker processes are spawned and import this module again, so the
+# app is only created when run as a script; `flask` finds create_app itself.
 if __name__ == "__main__":
-    socket.run(app, host="0.0.0.0", port=5000, debug=True, allow_unsafe_werkzeug=True)
+    app = create_app()
+    # Debug mode (FLASK_DEBUG=1 or WBC_DEBUG=true) runs this script twice: the
+    # reloader's parent only watches files, so only its child runs jobs.
+    if not app.debug or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        job_workers.start()
+        start_warm_up(app)
+    socket.run(
+        app,
+        host="0.0.0.0",
+        port=5000,
+        debug=app.debug,
+        allow_unsafe_werkzeug=True,
+    )
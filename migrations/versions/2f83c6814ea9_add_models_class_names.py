@@ -0,0 +1,26 @@
+"""add models.class_names
+
+Revision ID: 2f83c6814ea9
+Revises: b1c500ae12fb
+Create Date: 2026-10-18 09:40:03.551270
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2f83c6814ea9'
+down_revision = 'b1c500ae12fb'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('models', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('class_names', sa.JSON(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('models', schema=None) as batch_op:
+        batch_op.drop_column('class_names')
@@ -0,0 +1,78 @@
+"""store detection boxes as numeric columns
+
+Revision ID: 459465dfdc34
+Revises: 2018a18a84e9
+Create Date: 2026-10-18 11:48:35.202294
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '459465dfdc34'
+down_revision = '2018a18a84e9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('stats', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('model_id', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('x', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('y', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('w', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('h', sa.Float(), nullable=True))
+        batch_op.add_column(sa.Column('confidence', sa.Float(), nullable=True))
+        batch_op.create_foreign_key('stats_model_id_fkey', 'models', ['model_id'], ['id'], ondelete='SET NULL')
+
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        op.execute(
+            "UPDATE stats SET "
+            "x = split_part(box_coords, ' ', 1)::float, "
+            "y = split_part(box_coords, ' ', 2)::float, "
+            "w = split_part(box_coords, ' ', 3)::float, "
+            "h = split_part(box_coords, ' ', 4)::float "
+            "WHERE box_coords IS NOT NULL"
+        )
+    else:
+        rows = bind.execute(
+            sa.text("SELECT id, box_coords FROM stats WHERE box_coords IS NOT NULL")
+        ).fetchall()
+        if rows:
+            bind.execute(
+                sa.text("UPDATE stats SET x = :x, y = :y, w = :w, h = :h WHERE id = :id"),
+                [
+                    dict(zip(('x', 'y', 'w', 'h'), map(float, box_coords.split())), id=stats_id)
+                    for stats_id, box_coords in rows
+                ],
+            )
+
+    with op.batch_alter_table('stats', schema=None) as batch_op:
+        batch_op.drop_column('box_coords')
+
+
+def downgrade():
+    with op.batch_alter_table('stats', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('box_coords', sa.VARCHAR(length=100), nullable=True))
+
+    bind = op.get_bind()
+    rows = bind.execute(sa.text("SELECT id, x, y, w, h FROM stats WHERE x IS NOT NULL")).fetchall()
+    if rows:
+        bind.execute(
+            sa.text("UPDATE stats SET box_coords = :box_coords WHERE id = :id"),
+            [
+                {'id': stats_id, 'box_coords': " ".join(str(float(v)) for v in coords)}
+                for stats_id, *coords in rows
+            ],
+        )
+
+    with op.batch_alter_table('stats', schema=None) as batch_op:
+        batch_op.drop_constraint('stats_model_id_fkey', type_='foreignkey')
+        batch_op.drop_column('confidence')
+        batch_op.drop_column('h')
+        batch_op.drop_column('w')
+        batch_op.drop_column('y')
+        batch_op.drop_column('x')
+        batch_op.drop_column('model_id')
@@ -0,0 +1,492 @@
+"""Benchmark startup, upload, /run, the Stats tab and exports on synthetic data.
+
+Runs offline on a CPU-only machine. Synthetic smear images are uploaded
+through /upload_images and predicted through /run with a stand-in detector
+(a randomly initialized YOLOv8n whose every image yields the predictor's
+maximum of 300 boxes) or with --model; a separate synthetic Image/Stats
+dataset is generated for the Stats tab and the Parquet export. By default
+everything goes to a throwaway SQLite database; pass --database-uri to
+benchmark a local PostgreSQL. Results are printed (or written to --output)
+as JSON, so runs of different commits can be compared:
+
+    python scripts/benchmark.py --images 200 --output before.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List
+
+import numpy as np
+import psutil
+from PIL import Image as PILImage, ImageDraw, ImageFilter
+from sqlalchemy import insert
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from website import create_app, db  # noqa: E402
+from website.exports import EXPORT_PARQUET, EXPORT_YOLO, parquet_available  # noqa: E402
+from website.models import (  # noqa: E402
+    Batch,
+    BatchClassCount,
+    Image,
+    JOB_DONE,
+    MlModels,
+    Project,
+    Stats,
+    User,
+)
+from website.storage import release_images, remove_files  # noqa: E402
+from website.utils import bump_data_version  # noqa: E402
+
+CLASS_NAMES = ["neutrophil", "lymphocyte", "monocyte", "eosinophil", "basophil", "band_cell"]
+PHASES = ("startup", "upload", "run", "stats", "export")
+STAND_IN_MODEL_NAME = "benchmark-stand-in"
+# Keeps the confidence of every anchor of the untrained head above the
+# predictor's 0.25 threshold, so each image yields max_det boxes.
+STAND_IN_CLASS_BIAS = 2.0
+INSERT_CHUNK_SIZE = 10_000
+RSS_SAMPLE_INTERVAL = 0.01
+# Modules that must not be imported before a request needs them.
+HEAVY_MODULES = ("torch", "ultralytics", "pandas", "plotly", "alembic")
+# Run in a fresh interpreter, so imports cached by this process do not count.
+STARTUP_PROBE = """
+import json, sys, time
+started = time.perf_counter()
+from website import create_app
+imported = time.perf_counter()
+create_app({"SQLALCHEMY_DATABASE_URI": sys.argv[1]})
+created = time.perf_counter()
+print(json.dumps({
+    "import_seconds": imported - started,
+    "create_app_seconds": created - imported,
+    "heavy_modules": [name for name in sys.argv[2:] if name in sys.modules],
+}))
+"""
+
+
+def synthetic_smear(rng: random.Random, width: int, height: int) -> bytes:
+    """JPEG of pale red cells and a few stained nuclei on a smear background."""
+    image = PILImage.new("RGB", (width, height), (236, 214, 222))
+    draw = ImageDraw.Draw(image)
+    for _ in range(width * height // 2500):
+        x, y, r = rng.uniform(0, width), rng.uniform(0, height), rng.uniform(14, 20)
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=(214, 150, 160), outline=(190, 120, 135))
+    for _ in range(rng.randint(2, 8)):
+        x, y, r = rng.uniform(0, width), rng.uniform(0, height), rng.uniform(18, 30)
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=(200, 170, 200))
+        for _ in range(rng.randint(1, 4)):
+            dx, dy, rn = rng.uniform(-r / 2, r / 2), rng.uniform(-r / 2, r / 2), r / 2.5
+            draw.ellipse((x + dx - rn, y + dy - rn, x + dx + rn, y + dy + rn), fill=(95, 45, 130))
+    image = image.filter(ImageFilter.GaussianBlur(1))
+    noise = np.random.default_rng(rng.randrange(2**32)).normal(0, 6, (height, width, 3))
+    pixels = np.clip(np.asarray(image, dtype=np.float32) + noise, 0, 255).astype(np.uint8)
+    buffer = io.BytesIO()
+    PILImage.fromarray(pixels).save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def create_stand_in_model(path: str) -> None:
+    import torch
+    from ultralytics.nn.tasks import DetectionModel
+
+    torch.manual_seed(0)
+    model = DetectionModel("yolov8n.yaml", nc=len(CLASS_NAMES), verbose=False)
+    model.names = dict(enumerate(CLASS_NAMES))
+    for head in model.model[-1].cv3:
+        head[-1].bias.data.fill_(STAND_IN_CLASS_BIAS)
+    torch.save({"model": model, "train_args": {}}, path)
+
+
+class PeakRss:
+    """Samples the resident memory in a thread to catch its peak."""
+
+    def __init__(self):
+        self._process = psutil.Process()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self.baseline = self.peak = self._process.memory_info().rss
+
+    def __enter__(self) -> "PeakRss":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    @property
+    def delta(self) -> int:
+        return self.peak - self.baseline
+
+    def _sample(self) -> None:
+        while not self._stop.wait(RSS_SAMPLE_INTERVAL):
+            self.peak = max(self.peak, self._process.memory_info().rss)
+
+
+def latency_summary(seconds: List[float]) -> Dict[str, float]:
+    ordered = sorted(seconds)
+    return {
+        "requests": len(ordered),
+        "median_ms": round(1000 * statistics.median(ordered), 2),
+        "p95_ms": round(1000 * ordered[min(int(0.95 * len(ordered)), len(ordered) - 1)], 2),
+        "max_ms": round(1000 * ordered[-1], 2),
+    }
+
+
+def timed(request: Callable) -> float:
+    started = time.perf_counter()
+    response = request()
+    elapsed = time.perf_counter() - started
+    if response.status_code >= 400:
+        raise RuntimeError(f"{response.request.path} returned {response.status_code}")
+    return elapsed
+
+
+def create_project(user_id: int, name: str, n_batches: int) -> Dict:
+    project = Project(user_id=user_id, name=name, date=datetime.now())
+    db.session.add(project)
+    db.session.flush()
+    batches = [Batch(project_id=project.id, name=f"batch_{n}") for n in range(n_batches)]
+    db.session.add_all(batches)
+    db.session.commit()
+    return {"project_id": project.id, "batch_ids": [batch.id for batch in batches]}
+
+
+def generate_dataset(user_id: int, n_batches: int, n_images: int, stats_per_image: int) -> Dict:
+    """Inserts images (without files) and their detections in bulk."""
+    dataset = create_project(user_id, "benchmark-stats", n_batches)
+    rng = np.random.default_rng(0)
+    images_per_batch = max(n_images // n_batches, 1)
+    for batch_id in dataset["batch_ids"]:
+        db.session.execute(
+            insert(Image),
+            [
+                {
+                    "project_id": dataset["project_id"],
+                    "batch_id": batch_id,
+                    "name": f"img_{batch_id}_{n}.jpg",
+                    "image": f"benchmark/img_{batch_id}_{n}.jpg",
+                    "date": datetime.now(),
+                }
+                for n in range(images_per_batch)
+            ],
+        )
+        db.session.query(Batch).filter(Batch.id == batch_id).update(
+            {Batch.image_count: images_per_batch}
+        )
+    image_rows = db.session.query(Image.id, Image.batch_id).filter(
+        Image.project_id == dataset["project_id"]
+    )
+    class_counts = np.zeros((len(dataset["batch_ids"]), len(CLASS_NAMES)), dtype=np.int64)
+    batch_index = {batch_id: n for n, batch_id in enumerate(dataset["batch_ids"])}
+    rows = []
+    for image_id, batch_id in image_rows.all():
+        class_ids = rng.integers(0, len(CLASS_NAMES), stats_per_image)
+        boxes = rng.random((stats_per_image, 5))
+        np.add.at(class_counts[batch_index[batch_id]], class_ids, 1)
+        rows.extend(
+            {
+                "image_id": image_id,
+                "class_id": int(class_id),
+                "class_name": CLASS_NAMES[class_id],
+                "x": float(x),
+                "y": float(y),
+                "w": float(w) / 10,
+                "h": float(h) / 10,
+                "confidence": float(confidence),
+            }
+            for class_id, (x, y, w, h, confidence) in zip(class_ids, boxes)
+        )
+        if len(rows) >= INSERT_CHUNK_SIZE:
+            db.session.execute(insert(Stats), rows)
+            rows = []
+    if rows:
+        db.session.execute(insert(Stats), rows)
+    db.session.execute(
+        insert(BatchClassCount),
+        [
+            {
+                "project_id": dataset["project_id"],
+                "batch_id": batch_id,
+                "class_name": class_name,
+                "count": int(class_counts[batch_index[batch_id], n]),
+            }
+            for batch_id in dataset["batch_ids"]
+            for n, class_name in enumerate(CLASS_NAMES)
+        ],
+    )
+    db.session.commit()
+    dataset["images"] = images_per_batch * n_batches
+    dataset["stats"] = dataset["images"] * stats_per_image
+    return dataset
+
+
+def use_project(client, user_id: int, project_id: int, batch_id: int) -> None:
+    with client.session_transaction() as session:
+        session["_user_id"] = str(user_id)
+        session["_fresh"] = True
+        session["project_id"] = project_id
+        session["batch_id"] = batch_id
+        session["image_page"] = 1
+
+
+def benchmark_startup(database_uri: str, repeat: int) -> Dict:
+    runs = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        probe = subprocess.run(
+            [sys.executable, "-c", STARTUP_PROBE, database_uri, *HEAVY_MODULES],
+            cwd=Path(__file__).resolve().parent.parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        run = json.loads(probe.stdout.strip().splitlines()[-1])
+        run["process_seconds"] = time.perf_counter() - started
+        runs.append(run)
+    return {
+        "runs": len(runs),
+        **{
+            f"median_{name}": round(statistics.median(run[name] for run in runs), 3)
+            for name in ("import_seconds", "create_app_seconds", "process_seconds")
+        },
+        "heavy_modules": runs[0]["heavy_modules"],
+    }
+
+
+def benchmark_upload(client, images: List[bytes], per_request: int) -> Dict:
+    started = time.perf_counter()
+    for start in range(0, len(images), per_request):
+        files = [
+            (io.BytesIO(data), f"smear_{start + n}.jpg")
+            for n, data in enumerate(images[start : start + per_request])
+        ]
+        timed(
+            lambda: client.post(
+                "/upload_images",
+                data={"images[]": files},
+                content_type="multipart/form-data",
+            )
+        )
+    seconds = time.perf_counter() - started
+    size = sum(len(data) for data in images)
+    return {
+        "images": len(images),
+        "bytes": size,
+        "seconds": round(seconds, 3),
+        "images_per_second": round(len(images) / seconds, 2),
+        "megabytes_per_second": round(size / seconds / 1e6, 2),
+    }
+
+
+def benchmark_run(
+    client, model_name: str, project_id: int, batch_ids: List[int], timeout: float
+) -> Dict:
+    started = time.perf_counter()
+    response = client.post(
+        "/run",
+        data={"model-select": model_name, "batch-run-select": batch_ids, "run-mode": "force"},
+        headers={"Accept": "application/json"},
+    )
+    if response.status_code != 202:
+        raise RuntimeError(f"/run returned {response.status_code}")
+    job_id = response.json["id"]
+    while time.perf_counter() - started < timeout:
+        job = client.get(f"/jobs/{job_id}").json
+        if job["status"] not in ("queued", "running", "cancelling"):
+            break
+        time.sleep(0.1)
+    else:
+        raise RuntimeError(f"Job {job_id} did not finish in {timeout} s")
+    if job["status"] != JOB_DONE:
+        raise RuntimeError(f"Job {job_id} {job['status']}: {job['error']}")
+    seconds = time.perf_counter() - started
+    return {
+        "images": job["processed"],
+        "detections": db.session.query(Stats)
+        .join(Image, Stats.image_id == Image.id)
+        .filter(Image.project_id == project_id)
+        .count(),
+        "seconds": round(seconds, 3),
+        "images_per_second": round(job["processed"] / seconds, 2),
+        "timings": job["timings"],
+    }
+
+
+def benchmark_stats(client, dataset: Dict, repeat: int) -> Dict:
+    form = {
+        "batch-select": "batch_0",
+        "batch-stats-select": dataset["batch_ids"],
+        "plot-type-select": "Bar",
+        "wbc-class-select": [name.capitalize() for name in CLASS_NAMES],
+    }
+    cold, warm = [], []
+    for _ in range(repeat):
+        # A new data version invalidates the cached chart, as a result write would.
+        bump_data_version([dataset["project_id"]])
+        db.session.commit()
+        cold.append(timed(lambda: client.post("/project?tab=2", data=form)))
+        warm.append(timed(lambda: client.post("/project?tab=2", data=form)))
+    return {
+        "images": dataset["images"],
+        "stats": dataset["stats"],
+        "cold": latency_summary(cold),
+        "cached_chart": latency_summary(warm),
+    }
+
+
+def benchmark_export(client, batch_ids: List[int], export_format: str) -> Dict:
+    with PeakRss() as memory:
+        started = time.perf_counter()
+        response = client.post(
+            "/export",
+            data={"batch-export-select": batch_ids, "export-format": export_format},
+            buffered=False,
+        )
+        if response.status_code != 200:
+            raise RuntimeError(f"/export returned {response.status_code}")
+        size = sum(len(chunk) for chunk in response.iter_encoded())
+        response.close()
+        seconds = time.perf_counter() - started
+    return {
+        "format": export_format,
+        "bytes": size,
+        "seconds": round(seconds, 3),
+        "peak_rss_delta_bytes": memory.delta,
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=Path(__file__).resolve().parent.parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-uri", help="default: a throwaway SQLite database")
+    parser.add_argument("--model", help="YOLO checkpoint; default: the stand-in detector")
+    parser.add_argument("--phases", default=",".join(PHASES), help="comma-separated subset of " + ",".join(PHASES))
+    parser.add_argument("--images", type=int, default=100, help="images to upload and run")
+    parser.add_argument("--image-size", type=int, nargs=2, default=(1024, 768), metavar=("WIDTH", "HEIGHT"))
+    parser.add_argument("--upload-per-request", type=int, default=20)
+    parser.add_argument("--run-timeout", type=float, default=3600)
+    parser.add_argument("--stats-batches", type=int, default=20)
+    parser.add_argument("--stats-images", type=int, default=20_000)
+    parser.add_argument("--stats-per-image", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=20, help="requests per latency measurement")
+    parser.add_argument("--startup-repeat", type=int, default=5, help="app starts to measure")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+    phases = [phase for phase in args.phases.split(",") if phase]
+    unknown = set(phases) - set(PHASES)
+    if unknown:
+        parser.error(f"unknown phases: {', '.join(sorted(unknown))}")
+
+    workdir = tempfile.TemporaryDirectory(prefix="wbc-benchmark-")
+    database_uri = args.database_uri or f"sqlite:///{os.path.join(workdir.name, 'benchmark.db')}"
+    model_path = args.model or os.path.join(workdir.name, "stand_in.pt")
+    if args.model is None:
+        create_stand_in_model(model_path)
+
+    app = create_app({"SQLALCHEMY_DATABASE_URI": database_uri})
+    client = app.test_client()
+    report = {
+        "commit": git_commit(),
+        "created_at": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "parameters": vars(args),
+        "results": {},
+    }
+    with app.app_context():
+        report["database"] = db.engine.dialect.name
+        if args.database_uri is None:
+            # A given database is expected to be migrated already.
+            db.create_all()
+        app.extensions["job_workers"].start()
+        if "startup" in phases:
+            report["results"]["startup"] = benchmark_startup(database_uri, args.startup_repeat)
+        ml_model = MlModels.query.filter_by(name=STAND_IN_MODEL_NAME).first()
+        if ml_model is None:
+            ml_model = MlModels(name=STAND_IN_MODEL_NAME, model=model_path)
+            db.session.add(ml_model)
+        ml_model.model = model_path
+        user = User(email=f"benchmark-{os.getpid()}-{time.time_ns()}@wbc.local", name="benchmark")
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+        uploaded = create_project(user_id, "benchmark-run", 1)
+        dataset = None
+        orphans = []
+        try:
+            use_project(client, user_id, uploaded["project_id"], uploaded["batch_ids"][0])
+            rng = random.Random(args.seed)
+            if "upload" in phases or "run" in phases:
+                images = [synthetic_smear(rng, *args.image_size) for _ in range(args.images)]
+                report["results"]["upload"] = benchmark_upload(client, images, args.upload_per_request)
+            if "run" in phases:
+                report["results"]["run"] = benchmark_run(
+                    client,
+                    STAND_IN_MODEL_NAME,
+                    uploaded["project_id"],
+                    uploaded["batch_ids"],
+                    args.run_timeout,
+                )
+            if "stats" in phases or "export" in phases:
+                started = time.perf_counter()
+                dataset = generate_dataset(
+                    user_id, args.stats_batches, args.stats_images, args.stats_per_image
+                )
+                report["results"]["dataset_seconds"] = round(time.perf_counter() - started, 3)
+            if "stats" in phases:
+                use_project(client, user_id, dataset["project_id"], dataset["batch_ids"][0])
+                report["results"]["stats"] = benchmark_stats(client, dataset, args.repeat)
+            if "export" in phases:
+                use_project(client, user_id, uploaded["project_id"], uploaded["batch_ids"][0])
+                report["results"]["export_zip"] = benchmark_export(client, uploaded["batch_ids"], EXPORT_YOLO)
+                if parquet_available():
+                    use_project(client, user_id, dataset["project_id"], dataset["batch_ids"][0])
+                    report["results"]["export_parquet"] = benchmark_export(
+                        client, dataset["batch_ids"], EXPORT_PARQUET
+                    )
+        finally:
+            db.session.rollback()
+            orphans = release_images(Image.project_id == uploaded["project_id"])
+            db.session.query(Project).filter(Project.user_id == user_id).delete()
+            db.session.query(User).filter(User.id == user_id).delete()
+            db.session.commit()
+            remove_files(orphans)
+            app.extensions["job_workers"].stop()
+            app.extensions["inference_pool"].shutdown()
+            db.engine.dispose()
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output + "\n")
+    else:
+        print(output)
+    workdir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
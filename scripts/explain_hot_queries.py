@@ -0,0 +1,197 @@
+"""Report EXPLAIN ANALYZE plans of the hot queries against a generated dataset.
+
+Generates a throwaway user/project with many batches, images and detections
+directly in PostgreSQL, runs every hot query of the project page, /run,
+result writes and export under EXPLAIN (ANALYZE, BUFFERS) and removes the
+generated data again (unless --keep is given).
+
+    docker-compose exec wbc-scan-app python scripts/explain_hot_queries.py --images 200000
+"""
+import argparse
+import sys
+import uuid
+from pathlib import Path
+
+from sqlalchemy import func, text, tuple_
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from website import create_app, db  # noqa: E402
+from website.inference import get_images_to_run  # noqa: E402
+from website.models import Batch, BatchClassCount, Image, Stats  # noqa: E402
+
+CLASS_NAMES = ["neutrophil", "lymphocyte", "monocyte", "eosinophil", "basophil", "band_cell"]
+
+
+def generate_dataset(connection, n_batches: int, n_images: int, stats_per_image: int) -> dict:
+    email = f"explain-{uuid.uuid4().hex[:8]}@wbc.local"
+    user_id = connection.execute(
+        text("INSERT INTO \"user\" (email, name) VALUES (:email, 'explain') RETURNING id"),
+        {"email": email},
+    ).scalar()
+    project_id = connection.execute(
+        text(
+            "INSERT INTO project (user_id, name, date, data_version) "
+            "VALUES (:user_id, 'explain', now(), 0) RETURNING id"
+        ),
+        {"user_id": user_id},
+    ).scalar()
+    connection.execute(
+        text(
+            "INSERT INTO batch (project_id, name) "
+            "SELECT :project_id, 'batch_' || g FROM generate_series(1, :n) g"
+        ),
+        {"project_id": project_id, "n": n_batches},
+    )
+    connection.execute(
+        text(
+            "INSERT INTO image (project_id, batch_id, name, date, image) "
+            "SELECT :project_id, b.id, 'img_' || b.id || '_' || g || '.png', "
+            "now() - g * interval '1 second', 'img_' || b.id || '_' || g || '.png' "
+            "FROM batch b CROSS JOIN generate_series(1, :n) g WHERE b.project_id = :project_id"
+        ),
+        {"project_id": project_id, "n": max(n_images // n_batches, 1)},
+    )
+    connection.execute(
+        text(
+            "UPDATE batch SET image_count = "
+            "(SELECT count(*) FROM image WHERE image.batch_id = batch.id) "
+            "WHERE project_id = :project_id"
+        ),
+        {"project_id": project_id},
+    )
+    connection.execute(
+        text(
+            "INSERT INTO stats (image_id, class_id, class_name, x, y, w, h, confidence) "
+            "SELECT i.id, s.class_id, (:class_names)[s.class_id + 1], "
+            "random(), random(), random() * 0.1, random() * 0.1, random() "
+            "FROM image i CROSS JOIN LATERAL ("
+            "  SELECT floor(random() * :n_classes)::int + 0 * i.id AS class_id "
+            "  FROM generate_series(1, :n)"
+            ") s WHERE i.project_id = :project_id"
+        ),
+        {
+            "project_id": project_id,
+            "n": stats_per_image,
+            "class_names": CLASS_NAMES,
+            "n_classes": len(CLASS_NAMES),
+        },
+    )
+    connection.execute(
+        text(
+            "INSERT INTO batch_class_count (project_id, batch_id, class_name, count) "
+            "SELECT image.project_id, image.batch_id, stats.class_name, count(stats.id) "
+            "FROM stats JOIN image ON stats.image_id = image.id "
+            "WHERE image.project_id = :project_id "
+            "GROUP BY image.project_id, image.batch_id, stats.class_name"
+        ),
+        {"project_id": project_id},
+    )
+    connection.execute(text("ANALYZE"))
+    batch_ids = [
+        row[0]
+        for row in connection.execute(
+            text("SELECT id FROM batch WHERE project_id = :project_id ORDER BY id"),
+            {"project_id": project_id},
+        )
+    ]
+    return {"user_id": user_id, "project_id": project_id, "batch_ids": batch_ids}
+
+
+def hot_queries(project_id: int, batch_ids):
+    batch_id = batch_ids[0]
+    image_ids = (
+        db.session.query(Image.id)
+        .filter(Image.project_id == project_id, Image.batch_id == batch_id)
+        .order_by(Image.id)
+        .limit(64)
+    )
+    images = Image.query.filter_by(project_id=project_id, batch_id=batch_id).order_by(
+        Image.date, Image.id
+    )
+    middle = images.offset(images.count() // 2).first()
+    return {
+        "images page (/project/images)": images.filter(
+            tuple_(Image.date, Image.id) > (middle.date, middle.id)
+        ).limit(11),
+        "images to run (/run)": get_images_to_run(project_id, batch_ids[:3]),
+        "stats summary (stats tab)": (
+            db.session.query(
+                BatchClassCount.class_name,
+                Batch.name,
+                func.sum(BatchClassCount.count),
+            )
+            .join(Batch, BatchClassCount.batch_id == Batch.id)
+            .filter(
+                BatchClassCount.project_id == project_id,
+                BatchClassCount.batch_id.in_(batch_ids[:3]),
+                BatchClassCount.class_name.in_(CLASS_NAMES),
+            )
+            .group_by(BatchClassCount.class_name, Batch.name)
+        ),
+        "class names (project)": (
+            db.session.query(BatchClassCount.class_name)
+            .filter(BatchClassCount.project_id == project_id)
+            .distinct()
+        ),
+        "previous detections (result write)": db.session.query(Stats.id).filter(
+            Stats.image_id.in_(image_ids.scalar_subquery())
+        ),
+        "detections (export)": (
+            db.session.query(
+                Stats.class_id, Stats.x, Stats.y, Stats.w, Stats.h, Image.image
+            )
+            .join(Image, Stats.image_id == Image.id)
+            .filter(Image.batch_id.in_(batch_ids[:3]))
+            .order_by(Stats.image_id)
+        ),
+    }
+
+
+def explain(connection, query) -> str:
+    sql = query.statement.compile(
+        dialect=connection.dialect, compile_kwargs={"literal_binds": True}
+    )
+    rows = connection.execute(text(f"EXPLAIN (ANALYZE, BUFFERS) {sql}"))
+    return "\n".join(row[0] for row in rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batches", type=int, default=20)
+    parser.add_argument("--images", type=int, default=100_000)
+    parser.add_argument("--stats-per-image", type=int, default=100)
+    parser.add_argument("--keep", action="store_true", help="keep the generated data")
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        if db.engine.dialect.name != "postgresql":
+            sys.exit("EXPLAIN ANALYZE report requires PostgreSQL")
+        with db.engine.begin() as connection:
+            dataset = generate_dataset(
+                connection, args.batches, args.images, args.stats_per_image
+            )
+        print(
+            f"Generated project {dataset['project_id']} with {len(dataset['batch_ids'])} "
+            f"batches, ~{args.images} images, {args.stats_per_image} detections per image"
+        )
+        try:
+            with db.engine.connect() as connection:
+                for name, query in hot_queries(
+                    dataset["project_id"], dataset["batch_ids"]
+                ).items():
+                    print(f"\n=== {name} ===")
+                    print(explain(connection, query))
+                    connection.rollback()
+        finally:
+            if not args.keep:
+                with db.engine.begin() as connection:
+                    connection.execute(
+                        text("DELETE FROM \"user\" WHERE id = :user_id"),
+                        {"user_id": dataset["user_id"]},
+                    )
+
+
+if __name__ == "__main__":
+    main()
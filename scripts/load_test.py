@@ -0,0 +1,180 @@
+"""Load test a running server with concurrent signed-in users.
+
+Every virtual user signs in through /login and /verify_mfa with its own
+session and then requests the read-heavy pages of one project in a loop.
+Each level of --users runs for --duration seconds; the report has the
+throughput and the latency percentiles of every endpoint per level:
+
+    python scripts/load_test.py --url http://localhost:5000 \\
+        --email user@example.com --password secret --mfa-secret BASE32SECRET \\
+        --project-id 1 --users 8,16,32 --duration 30 --output workers-2.json
+"""
+import argparse
+import json
+import statistics
+import sys
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List
+
+import pyotp
+import requests
+
+# (name, path) requested in turn by every virtual user.
+ENDPOINTS = (
+    ("project", "/project?tab=1"),
+    ("stats", "/project?tab=2"),
+    ("images", "/project/images?direction=first"),
+    ("jobs", "/jobs"),
+)
+REQUEST_TIMEOUT = 60
+
+
+def sign_in(args) -> requests.Session:
+    http = requests.Session()
+    response = http.post(
+        f"{args.url}/login",
+        data={"email": args.email, "password": args.password},
+        timeout=REQUEST_TIMEOUT,
+    )
+    response.raise_for_status()
+    response = http.post(
+        f"{args.url}/verify_mfa",
+        data={"mfa": pyotp.TOTP(args.mfa_secret).now()},
+        allow_redirects=False,
+        timeout=REQUEST_TIMEOUT,
+    )
+    # A valid code redirects to the home page, a wrong one renders the form.
+    if response.status_code != 302:
+        raise RuntimeError(f"Could not sign in as {args.email}")
+    # Selects the project in the session, as opening it from the home page does.
+    response = http.get(
+        f"{args.url}/project",
+        params={"project_id": args.project_id, "tab": 1},
+        timeout=REQUEST_TIMEOUT,
+    )
+    response.raise_for_status()
+    return http
+
+
+def virtual_user(
+    http: requests.Session,
+    url: str,
+    deadline: float,
+    results: Dict[str, List[float]],
+    errors: Dict[str, int],
+    lock: threading.Lock,
+) -> None:
+    n = 0
+    while time.monotonic() < deadline:
+        name, path = ENDPOINTS[n % len(ENDPOINTS)]
+        n += 1
+        started = time.perf_counter()
+        try:
+            ok = http.get(f"{url}{path}", timeout=REQUEST_TIMEOUT).status_code == 200
+        except requests.RequestException:
+            ok = False
+        seconds = time.perf_counter() - started
+        with lock:
+            if ok:
+                results[name].append(seconds)
+            else:
+                errors[name] += 1
+
+
+def percentiles(latencies: List[float]) -> Dict[str, float]:
+    if len(latencies) < 2:
+        value = round(1000 * latencies[0], 1) if latencies else None
+        return {"p50_ms": value, "p95_ms": value, "p99_ms": value}
+    cuts = statistics.quantiles(latencies, n=100)
+    return {
+        "p50_ms": round(1000 * cuts[49], 1),
+        "p95_ms": round(1000 * cuts[94], 1),
+        "p99_ms": round(1000 * cuts[98], 1),
+    }
+
+
+def run_level(args, users: int) -> Dict:
+    sessions = [sign_in(args) for _ in range(users)]
+    results: Dict[str, List[float]] = defaultdict(list)
+    errors: Dict[str, int] = defaultdict(int)
+    lock = threading.Lock()
+    deadline = time.monotonic() + args.duration
+    started = time.perf_counter()
+    threads = [
+        threading.Thread(
+            target=virtual_user,
+            args=(http, args.url, deadline, results, errors, lock),
+        )
+        for http in sessions
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - started
+    endpoints = {}
+    for name, _ in ENDPOINTS:
+        endpoints[name] = {
+            "requests": len(results[name]),
+            "errors": errors[name],
+            "rps": round(len(results[name]) / seconds, 2),
+            **percentiles(results[name]),
+        }
+    latencies = [value for values in results.values() for value in values]
+    return {
+        "users": users,
+        "seconds": round(seconds, 2),
+        "requests": len(latencies),
+        "errors": sum(errors.values()),
+        "rps": round(len(latencies) / seconds, 2),
+        **percentiles(latencies),
+        "endpoints": endpoints,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://localhost:5000")
+    parser.add_argument("--email", required=True)
+    parser.add_argument("--password", required=True)
+    parser.add_argument("--mfa-secret", required=True, help="TOTP secret of the user.")
+    parser.add_argument("--project-id", type=int, required=True)
+    parser.add_argument(
+        "--users", default="8,16,32", help="Comma-separated concurrency levels."
+    )
+    parser.add_argument("--duration", type=float, default=30, help="Seconds per level.")
+    parser.add_argument("--label", default=None, help="E.g. the server configuration.")
+    parser.add_argument("--output", default=None, help="Write the JSON report here.")
+    args = parser.parse_args()
+    args.url = args.url.rstrip("/")
+
+    levels = []
+    for users in (int(users) for users in args.users.split(",")):
+        result = run_level(args, users)
+        levels.append(result)
+        print(
+            f"{users} users: {result['rps']} req/s, p50 {result['p50_ms']} ms, "
+            f"p95 {result['p95_ms']} ms, p99 {result['p99_ms']} ms, "
+            f"{result['errors']} errors",
+            file=sys.stderr,
+        )
+    report = {
+        "url": args.url,
+        "label": args.label,
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "duration": args.duration,
+        "levels": levels,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import io
+import os
+from typing import Dict, List, Optional, Sequence
+
+from PIL import Image as PILImage, ImageDraw
+
+from . import db
+from .lru_cache import LRUCache
+from .models import Image, Stats
+from .storage import storage_path
+from .thumbnails import PREVIEW, THUMBNAIL_SIZES, thumbnail_path, to_rgb
+
+DEFAULT_ANNOTATION_CACHE_MAX_BYTES = 64 * 1024 * 1024
+ANNOTATION_FORMAT = "JPEG"
+ANNOTATION_MIMETYPE = "image/jpeg"
+ANNOTATION_COLORS = (
+    "#FF3838",
+    "#FF9D97",
+    "#FF701F",
+    "#FFB21D",
+    "#CFD231",
+    "#48F90A",
+    "#92CC17",
+    "#3DDB86",
+    "#1A9334",
+    "#00D4BB",
+    "#2C99A8",
+    "#00C2FF",
+    "#344593",
+    "#6473FF",
+    "#0018EC",
+    "#8438FF",
+    "#520085",
+    "#CB38FF",
+    "#FF95C8",
+    "#FF37C7",
+)
+# Below this size labels are unreadable, so only the boxes are drawn.
+ANNOTATION_LABEL_MIN_SIDE = 512
+# Full-size renders are scaled down to this; JPEG cannot store more than
+# 65535 px a side and a tiled slide can be larger.
+ANNOTATION_MAX_SIDE = 8192
+
+
+class AnnotationCache(LRUCache):
+    """LRU cache of rendered annotated images, bounded by their total size."""
+
+    def __init__(self, app=None):
+        super().__init__(max_bytes=DEFAULT_ANNOTATION_CACHE_MAX_BYTES)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_bytes = app.config.setdefault(
+            "ANNOTATION_CACHE_MAX_BYTES", DEFAULT_ANNOTATION_CACHE_MAX_BYTES
+        )
+        app.extensions["annotation_cache"] = self
+
+
+def annotation_cache_key(
+    image_id: int, data_version: int, max_side: Optional[int], class_names
+):
+    return image_id, data_version, max_side, tuple(sorted(class_names or ()))
+
+
+def get_detections(image_id: int, class_names: Optional[Sequence[str]] = None):
+    detections = db.session.query(
+        Stats.class_id,
+        Stats.class_name,
+        Stats.x,
+        Stats.y,
+        Stats.w,
+        Stats.h,
+        Stats.confidence,
+    ).filter(Stats.image_id == image_id)
+    if class_names:
+        detections = detections.filter(Stats.class_name.in_(class_names))
+    return detections.order_by(Stats.id).all()
+
+
+def detection_to_dict(detection) -> Dict:
+    return dict(detection._mapping)
+
+
+def render_annotated_image(
+    image: Image, detections: List, max_side: Optional[int] = None
+) -> bytes:
+    max_side = min(max_side or ANNOTATION_MAX_SIDE, ANNOTATION_MAX_SIDE)
+    with _open_base_image(image.image, max_side) as base:
+        base.draft("RGB", (max_side, max_side))
+        rendered = to_rgb(base)
+    rendered.thumbnail((max_side, max_side))
+    width, height = rendered.size
+    line_width = max(round((width + height) / 2 * 0.003), 2)
+    draw = ImageDraw.Draw(rendered)
+    draw_labels = max(width, height) >= ANNOTATION_LABEL_MIN_SIDE
+    for detection in detections:
+        color = ANNOTATION_COLORS[detection.class_id % len(ANNOTATION_COLORS)]
+        left = (detection.x - detection.w / 2) * width
+        top = (detection.y - detection.h / 2) * height
+        right = (detection.x + detection.w / 2) * width
+        bottom = (detection.y + detection.h / 2) * height
+        draw.rectangle((left, top, right, bottom), outline=color, width=line_width)
+        if draw_labels:
+            label = detection.class_name
+            if detection.confidence is not None:
+                label = f"{label} {detection.confidence:.2f}"
+            text_left, text_top, text_right, text_bottom = draw.textbbox((0, 0), label)
+            label_height = text_bottom - text_top + 2
+            label_top = max(top - label_height, 0)
+            draw.rectangle(
+                (left, label_top, left + text_right - text_left + 2, label_top + label_height),
+                fill=color,
+            )
+            draw.text((left + 1, label_top), label, fill="white")
+    buffer = io.BytesIO()
+    rendered.save(buffer, ANNOTATION_FORMAT, quality=90)
+    return buffer.getvalue()
+
+
+def _open_base_image(image_path: str, max_side: int) -> PILImage.Image:
+    # Thumbnails and previews are drawn on the stored preview, so a cache
+    # miss does not decode the full-resolution original.
+    preview_path = thumbnail_path(PREVIEW, image_path)
+    if max_side <= THUMBNAIL_SIZES[PREVIEW] and os.path.exists(preview_path):
+        return PILImage.open(preview_path)
+    return PILImage.open(storage_path(image_path))
+
+
+annotation_cache = AnnotationCache()
@@ -2,7 +2,6 @@ from base64 import b64encode
 from io import BytesIO
 
 import pyotp
-import qrcode
 from flask import Blueprint, render_template, request, flash, redirect, url_for, session
 from flask_login import login_user, logout_user, login_required
 from validate_email import validate_email
@@ -89,6 +88,8 @@ def mfa_setup():
 
 
 def _get_qr_code_to_setup_mfa(url: str):
+    import qrcode
+
     qrcode_handle = qrcode.QRCode(version=1, box_size=10, border=5)
     qrcode_handle.add_data(url)
     qrcode_img = qrcode_handle.make_image(fill_color='black', back_color='white')
@@ -0,0 +1,285 @@
+import os
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import click
+import numpy as np
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import func
+
+from . import db
+from .loader import decode_image, model_input_size
+from .model_registry import model_registry, read_class_names
+from .models import (
+    BACKEND_EXPORTED,
+    BACKEND_REJECTED,
+    BACKEND_VERIFIED,
+    Image,
+    MlModels,
+    ModelBackend,
+)
+
+BACKEND_PYTORCH = "pytorch"
+BACKEND_ONNX = "onnx"
+BACKEND_ONNX_INT8 = "onnx-int8"
+BACKEND_OPENVINO = "openvino"
+BACKENDS = (BACKEND_ONNX, BACKEND_ONNX_INT8, BACKEND_OPENVINO)
+BACKEND_AUTO = "auto"
+ML_MODELS_DIR = Path(__file__).parent.parent / "ml_models"
+WEIGHTS_SUFFIX = ".pt"
+
+models_cli = AppGroup("models", help="Register models and their optimized backends.")
+
+
+def select_backend(ml_model: MlModels, weights_hash: str) -> Optional[ModelBackend]:
+    """Returns the fastest verified backend built from the current weights.
+
+    A backend that was not faster than PyTorch when verified is never
+    selected; None means the PyTorch weights.
+    """
+    for model_backend in ModelBackend.query.filter_by(
+        model_id=ml_model.id, weights_hash=weights_hash, status=BACKEND_VERIFIED
+    ).order_by(ModelBackend.latency_ms):
+        baseline_latency_ms = (model_backend.metrics or {}).get("baseline_latency_ms")
+        if baseline_latency_ms is not None and (
+            model_backend.latency_ms < baseline_latency_ms
+        ):
+            return model_backend
+    return None
+
+
+def export_backend(ml_model: MlModels, backend: str) -> ModelBackend:
+    from ultralytics import YOLO
+
+    model = YOLO(ml_model.model, task="detect")
+    if backend == BACKEND_ONNX:
+        path = model.export(format="onnx", dynamic=True, simplify=False)
+    elif backend == BACKEND_ONNX_INT8:
+        path = _quantize_onnx(model.export(format="onnx", dynamic=True, simplify=False))
+    elif backend == BACKEND_OPENVINO:
+        path = model.export(format="openvino", dynamic=True)
+    else:
+        raise ValueError(f"Unknown backend {backend}")
+    model_backend = ModelBackend.query.filter_by(
+        model_id=ml_model.id, backend=backend
+    ).first() or ModelBackend(model_id=ml_model.id, backend=backend)
+    model_backend.path = str(path)
+    model_backend.weights_hash = model_registry.weights_hash(ml_model)
+    model_backend.status = BACKEND_EXPORTED
+    model_backend.latency_ms = None
+    model_backend.metrics = None
+    model_backend.created_at = datetime.now()
+    model_backend.verified_at = None
+    db.session.add(model_backend)
+    db.session.commit()
+    model_registry.evict(ml_model.id)
+    return model_backend
+
+
+def _quantize_onnx(onnx_path: str) -> str:
+    import onnx
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    int8_path = f"{os.path.splitext(onnx_path)[0]}.int8.onnx"
+    quantize_dynamic(onnx_path, int8_path, weight_type=QuantType.QUInt8)
+    # Keep the class names, stride and input size ultralytics stores in the
+    # metadata of the exported model.
+    source, quantized = onnx.load(onnx_path), onnx.load(int8_path)
+    del quantized.metadata_props[:]
+    quantized.metadata_props.extend(source.metadata_props)
+    onnx.save(quantized, int8_path)
+    return int8_path
+
+
+def verify_backend(
+    ml_model: MlModels, model_backend: ModelBackend, samples: int
+) -> Dict:
+    """Compares detections of the backend with the PyTorch weights.
+
+    The backend is activated (status ``verified``) only when it finds at
+    least ``ML_BACKENDS_MIN_AGREEMENT`` of the baseline boxes and that
+    share of its own boxes matches a baseline box of the same class.
+    """
+    image_paths = [
+        path
+        for (path,) in db.session.query(Image.image)
+        .order_by(func.random())
+        .limit(samples)
+    ]
+    if not image_paths:
+        raise click.ClickException("No images to verify the backend on")
+    baseline = model_registry.get(ml_model)
+    candidate = model_registry.get(ml_model, model_backend)
+    arrays = [
+        decode_image(path, model_input_size(baseline)) for path in image_paths
+    ]
+    baseline_boxes, baseline_seconds = _predict_timed(baseline, arrays)
+    candidate_boxes, candidate_seconds = _predict_timed(candidate, arrays)
+    iou_threshold = current_app.config["ML_BACKENDS_VERIFY_IOU"]
+    matched = sum(
+        _count_matches(expected, found, iou_threshold)
+        for expected, found in zip(baseline_boxes, candidate_boxes)
+    )
+    n_baseline = sum(len(boxes[0]) for boxes in baseline_boxes)
+    n_candidate = sum(len(boxes[0]) for boxes in candidate_boxes)
+    metrics = {
+        "images": len(arrays),
+        "baseline_boxes": n_baseline,
+        "backend_boxes": n_candidate,
+        "recall": matched / n_baseline if n_baseline else 1.0,
+        "precision": matched / n_candidate if n_candidate else 1.0,
+        "baseline_latency_ms": 1000 * baseline_seconds / len(arrays),
+        "latency_ms": 1000 * candidate_seconds / len(arrays),
+    }
+    min_agreement = current_app.config["ML_BACKENDS_MIN_AGREEMENT"]
+    accepted = min(metrics["recall"], metrics["precision"]) >= min_agreement
+    model_backend.status = BACKEND_VERIFIED if accepted else BACKEND_REJECTED
+    model_backend.latency_ms = metrics["latency_ms"]
+    model_backend.metrics = metrics
+    model_backend.verified_at = datetime.now()
+    db.session.commit()
+    return metrics
+
+
+def _predict_timed(model, arrays: List[np.ndarray]) -> Tuple[List, float]:
+    # The first call initializes the runtime, keep it out of the timing.
+    model.predict(arrays[:1], stream=False, save=False, verbose=False)
+    started = time.perf_counter()
+    predictions = model.predict(arrays, stream=False, save=False, verbose=False)
+    seconds = time.perf_counter() - started
+    return [
+        (
+            prediction.boxes.xyxyn.cpu().numpy(),
+            prediction.boxes.cls.cpu().numpy().astype(int),
+        )
+        for prediction in predictions
+    ], seconds
+
+
+def _count_matches(expected, found, iou_threshold: float) -> int:
+    expected_xyxy, expected_classes = expected
+    found_xyxy, found_classes = found
+    if not len(expected_xyxy) or not len(found_xyxy):
+        return 0
+    iou = _box_iou(expected_xyxy, found_xyxy)
+    iou[expected_classes[:, None] != found_classes[None, :]] = 0
+    matched_expected, matched_found = set(), set()
+    # Greedy one-to-one matching, best overlaps first.
+    for i, j in zip(*np.unravel_index(np.argsort(-iou, axis=None), iou.shape)):
+        if iou[i, j] < iou_threshold:
+            break
+        if i not in matched_expected and j not in matched_found:
+            matched_expected.add(i)
+            matched_found.add(j)
+    return len(matched_expected)
+
+
+def _box_iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    top_left = np.maximum(a[:, None, :2], b[None, :, :2])
+    bottom_right = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area_a = np.prod(a[:, 2:] - a[:, :2], axis=1)
+    area_b = np.prod(b[:, 2:] - b[:, :2], axis=1)
+    return intersection / (area_a[:, None] + area_b[None, :] - intersection + 1e-9)
+
+
+def _get_ml_model(name: str) -> MlModels:
+    ml_model = MlModels.query.filter_by(name=name).first()
+    if ml_model is None:
+        raise click.ClickException(f"Unknown model {name}")
+    return ml_model
+
+
+def _echo_metrics(model_backend: ModelBackend, metrics: Dict) -> None:
+    click.echo(
+        f"{model_backend.backend}: {model_backend.status}, "
+        f"recall {metrics['recall']:.3f}, precision {metrics['precision']:.3f}, "
+        f"{metrics['latency_ms']:.1f} ms/image "
+        f"(PyTorch {metrics['baseline_latency_ms']:.1f} ms/image)"
+    )
+
+
+@models_cli.command("sync")
+def sync_command():
+    """Register the weights in ml_models/ that are not registered yet.
+
+    Also stores the weights hash and class names of models that miss them,
+    so requests never load a model just to read its classes.
+    """
+    registered = {path for (path,) in db.session.query(MlModels.model)}
+    for path in sorted(ML_MODELS_DIR.iterdir()):
+        if path.suffix == WEIGHTS_SUFFIX and str(path) not in registered:
+            db.session.add(MlModels(model=str(path), name=path.name))
+            click.echo(f"Registered {path.name}")
+    db.session.flush()
+    for ml_model in MlModels.query.order_by(MlModels.id):
+        if not os.path.exists(ml_model.model):
+            click.echo(f"Missing weights of {ml_model.name}: {ml_model.model}", err=True)
+            continue
+        # Resets the class names when the weights file was replaced.
+        model_registry.weights_hash(ml_model)
+        if ml_model.class_names is None:
+            ml_model.class_names = read_class_names(ml_model.model)
+            click.echo(f"Stored the classes of {ml_model.name}")
+    db.session.commit()
+
+
+@models_cli.command("export")
+@click.argument("name")
+@click.option("--backend", type=click.Choice(BACKENDS), default=BACKEND_ONNX)
+@click.option("--verify/--no-verify", default=True, help="Verify after export.")
+@click.option("--samples", type=int, default=None, help="Images to verify on.")
+def export_command(name: str, backend: str, verify: bool, samples: Optional[int]):
+    """Export a registered model to an optimized backend."""
+    ml_model = _get_ml_model(name)
+    model_backend = export_backend(ml_model, backend)
+    click.echo(f"Exported {name} to {model_backend.path}")
+    if verify:
+        metrics = verify_backend(
+            ml_model,
+            model_backend,
+            samples or current_app.config["ML_BACKENDS_VERIFY_SAMPLES"],
+        )
+        _echo_metrics(model_backend, metrics)
+
+
+@models_cli.command("verify")
+@click.argument("name")
+@click.option("--backend", type=click.Choice(BACKENDS), default=BACKEND_ONNX)
+@click.option("--samples", type=int, default=None, help="Images to verify on.")
+def verify_command(name: str, backend: str, samples: Optional[int]):
+    """Compare an exported backend with the PyTorch weights."""
+    ml_model = _get_ml_model(name)
+    model_backend = ModelBackend.query.filter_by(
+        model_id=ml_model.id, backend=backend
+    ).first()
+    if model_backend is None:
+        raise click.ClickException(f"{name} has no {backend} export")
+    metrics = verify_backend(
+        ml_model,
+        model_backend,
+        samples or current_app.config["ML_BACKENDS_VERIFY_SAMPLES"],
+    )
+    _echo_metrics(model_backend, metrics)
+
+
+@models_cli.command("list")
+def list_command():
+    """List models and their exported backends."""
+    for ml_model in MlModels.query.order_by(MlModels.id):
+        weights_hash = model_registry.weights_hash(ml_model)
+        click.echo(f"{ml_model.name} ({ml_model.model})")
+        for model_backend in ModelBackend.query.filter_by(model_id=ml_model.id):
+            stale = "" if model_backend.weights_hash == weights_hash else ", stale"
+            latency = (
+                f", {model_backend.latency_ms:.1f} ms/image"
+                if model_backend.latency_ms is not None
+                else ""
+            )
+            click.echo(
+                f"  {model_backend.backend}: {model_backend.status}{latency}{stale} "
+                f"({model_backend.path})"
+            )
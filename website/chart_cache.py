@@ -0,0 +1,33 @@
+from .lru_cache import LRUCache
+
+DEFAULT_CHART_CACHE_MAX_ENTRIES = 256
+
+
+class ChartCache(LRUCache):
+    """LRU cache of serialized Plotly figures, bounded by their number."""
+
+    def __init__(self, app=None):
+        super().__init__(max_entries=DEFAULT_CHART_CACHE_MAX_ENTRIES)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_entries = app.config.setdefault(
+            "CHART_CACHE_MAX_ENTRIES", DEFAULT_CHART_CACHE_MAX_ENTRIES
+        )
+        app.extensions["chart_cache"] = self
+
+
+def chart_cache_key(
+    project_id: int, batch_ids, class_names, plot_type: str, data_version: int
+):
+    return (
+        project_id,
+        tuple(sorted(batch_ids)),
+        tuple(sorted(class_names)),
+        plot_type,
+        data_version,
+    )
+
+
+chart_cache = ChartCache()
@@ -0,0 +1,39 @@
+import json
+
+import pandas as pd
+import plotly
+import plotly.express as px
+
+BAR = "Bar"
+PIE = "Pie"
+
+
+def render_class_counts_chart(rows, plot_type: str):
+    df_for_plot = pd.DataFrame(rows, columns=["class_name", "batch_name", "count"])
+    if plot_type == BAR:
+        fig = px.bar(
+            df_for_plot,
+            x="class_name",
+            y="count",
+            color="batch_name",
+            barmode="group",
+            title="WBC class counts",
+            template="plotly",
+            text_auto=True,
+        )
+        graphJSON = json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder)
+        return graphJSON
+    elif plot_type == PIE:
+        fig = px.pie(
+            df_for_plot,
+            values="count",
+            names="class_name",
+            facet_col="batch_name",
+            facet_col_wrap=3,
+            title="WBC class counts",
+            template="plotly",
+        )
+        fig.update_traces(textposition="inside", textinfo="percent+label")
+        graphJSON = json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder)
+        return graphJSON
+    return None
@@ -0,0 +1,162 @@
+import io
+import os
+import zipfile
+from itertools import groupby, islice
+from typing import Dict, Iterator, List
+
+from sqlalchemy import select
+
+from . import db
+from .models import Batch, Image, Stats
+from .storage import storage_path
+
+EXPORT_YOLO = "yolo"
+EXPORT_PARQUET = "parquet"
+EXPORT_YIELD_PER = 10_000
+PARQUET_ROW_GROUP_SIZE = 100_000
+EXPORT_CHUNK_SIZE = 1024 * 1024
+EXPORT_COLUMNS = (
+    Stats.image_id,
+    Image.name.label("image_name"),
+    Image.image,
+    Image.batch_id,
+    Stats.class_id,
+    Stats.class_name,
+    Stats.x,
+    Stats.y,
+    Stats.w,
+    Stats.h,
+    Stats.confidence,
+)
+
+
+def iter_export_rows(project_id: int, batch_ids: List[int]):
+    """Streams detections of the batches ordered by image.
+
+    ``yield_per`` makes PostgreSQL use a server-side cursor, so only
+    ``EXPORT_YIELD_PER`` rows are held in memory at a time.
+    """
+    statement = (
+        select(*EXPORT_COLUMNS)
+        .join(Image, Stats.image_id == Image.id)
+        .filter(Image.project_id == project_id, Image.batch_id.in_(batch_ids))
+        .order_by(Stats.image_id, Stats.id)
+        .execution_options(yield_per=EXPORT_YIELD_PER)
+    )
+    return db.session.execute(statement)
+
+
+class _ResponseStream(io.RawIOBase):
+    """Write-only file whose content is taken out with ``pop``."""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def pop(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_yolo_zip(
+    project_id: int, batch_ids: List[int], class_names: Dict[int, str]
+) -> Iterator[bytes]:
+    stream = _ResponseStream()
+    with zipfile.ZipFile(stream, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr(
+            "classes.txt", "".join(f"{name}\n" for name in class_names.values())
+        )
+        archive.writestr("images/", "")
+        archive.writestr("labels/", "")
+        yield stream.pop()
+        exported_names = set()
+        for (image_id, name, image_path), rows in groupby(
+            iter_export_rows(project_id, batch_ids),
+            key=lambda row: (row.image_id, row.image_name, row.image),
+        ):
+            if name in exported_names:
+                name = f"{image_id}_{name}"
+            exported_names.add(name)
+            archive.writestr(
+                f"labels/{os.path.splitext(name)[0]}.txt",
+                "".join(
+                    f"{row.class_id} {row.x} {row.y} {row.w} {row.h}\n" for row in rows
+                ),
+            )
+            yield stream.pop()
+            yield from _write_file(archive, stream, f"images/{name}", image_path)
+    yield stream.pop()
+
+
+def _write_file(
+    archive: zipfile.ZipFile, stream: _ResponseStream, name: str, image_path: str
+) -> Iterator[bytes]:
+    path = storage_path(image_path)
+    info = zipfile.ZipInfo(name)
+    # Images are compressed already, deflating them again only costs CPU.
+    info.compress_type = zipfile.ZIP_STORED
+    with open(path, "rb") as source, archive.open(
+        info, "w", force_zip64=os.path.getsize(path) > zipfile.ZIP64_LIMIT
+    ) as destination:
+        while chunk := source.read(EXPORT_CHUNK_SIZE):
+            destination.write(chunk)
+            yield stream.pop()
+
+
+def parquet_available() -> bool:
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def stream_parquet(project_id: int, batch_ids: List[int]) -> Iterator[bytes]:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema(
+        [
+            ("image_id", pa.int64()),
+            ("image_name", pa.string()),
+            ("batch_id", pa.int64()),
+            ("batch_name", pa.string()),
+            ("class_id", pa.int32()),
+            ("class_name", pa.string()),
+            ("x", pa.float32()),
+            ("y", pa.float32()),
+            ("w", pa.float32()),
+            ("h", pa.float32()),
+            ("confidence", pa.float32()),
+        ]
+    )
+    batch_names = dict(
+        db.session.query(Batch.id, Batch.name).filter(Batch.id.in_(batch_ids))
+    )
+    stream = _ResponseStream()
+    rows = iter(iter_export_rows(project_id, batch_ids))
+    with pq.ParquetWriter(stream, schema, compression="zstd") as writer:
+        while row_group := list(islice(rows, PARQUET_ROW_GROUP_SIZE)):
+            columns = {name: [] for name in schema.names}
+            for row in row_group:
+                for name in schema.names:
+                    columns[name].append(
+                        batch_names.get(row.batch_id)
+                        if name == "batch_name"
+                        else getattr(row, name)
+                    )
+            writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+            yield stream.pop()
+    yield stream.pop()
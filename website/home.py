@@ -2,7 +2,8 @@ from flask import Blueprint, render_template, request, flash, redirect, url_for,
 from flask_login import login_required, current_user
 
 from . import db
-from .models import Project
+from .models import Image, Project
+from .storage import release_images, remove_files
 from .utils import get_user_projects, add_project_to_db
 
 home_views = Blueprint('home_views', __name__)
@@ -30,8 +31,11 @@ def delete_project():
         if not projects_id_to_delete:
             flash("No projects selected", category="error")
         else:
-            db.session.query(Project).filter(Project.id.in_(projects_id_to_delete),
-                                             Project.user_id == current_user.id).delete()
+            projects_id_to_delete = [project_id for (project_id,) in db.session.query(Project.id).filter(
+                Project.id.in_(projects_id_to_delete), Project.user_id == current_user.id)]
+            orphans = release_images(Image.project_id.in_(projects_id_to_delete))
+            db.session.query(Project).filter(Project.id.in_(projects_id_to_delete)).delete()
             db.session.commit()
+            remove_files(orphans)
             flash("Project successfully deleted", category="success")
     return redirect(url_for("home_views.home"))
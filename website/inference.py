@@ -0,0 +1,307 @@
+import time
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from flask import current_app
+from sqlalchemy import func, or_
+
+from . import db
+from .backends import BACKEND_AUTO, BACKEND_PYTORCH, select_backend
+from .inference_pool import inference_pool, weights_key
+from .loader import ImageLoader, model_input_size
+from .metrics import metrics
+from .model_registry import model_registry
+from .models import Image, MlModels, ModelBackend, Job, Stats, JOB_CANCELLING
+from .progress import progress
+from .results import STATS_COLUMNS, ResultWriter
+from .storage import release_references, remove_files
+from .tiling import TILING_AUTO, predict_tiled, use_tiling
+from .utils import error_message, iter_image_batches, predict_arrays
+
+
+RUN_NEW = "new"
+RUN_FORCE = "force"
+# Failed images listed in job.error; the rest are only counted.
+MAX_IMAGE_ERRORS = 20
+
+
+def get_images_to_run(
+    project_id: int,
+    batch_ids,
+    after_image_id: int = 0,
+    skip_results_of: Optional[Tuple[int, str, str]] = None,
+):
+    images = db.session.query(Image).filter(
+        Image.batch_id.in_(batch_ids),
+        Image.project_id == project_id,
+        Image.id > after_image_id,
+    )
+    if skip_results_of is not None:
+        model_id, weights_hash, backend = skip_results_of
+        images = images.filter(
+            or_(
+                Image.result_model_id.is_distinct_from(model_id),
+                Image.result_weights_hash.is_distinct_from(weights_hash),
+                Image.result_backend.is_distinct_from(backend),
+            )
+        )
+    return images.order_by(Image.id)
+
+
+def find_cached_results(
+    images, model_id: int, weights_hash: str, backend: str
+) -> Dict[str, int]:
+    """Maps image files to an image that already has their detections.
+
+    Only detections of the same weights run on the same backend count, so
+    forcing the PyTorch weights never reuses e.g. INT8 results.
+    """
+    paths = images.with_entities(Image.image).order_by(None).scalar_subquery()
+    return dict(
+        db.session.query(Image.image, func.min(Image.id))
+        .filter(
+            Image.image.in_(paths),
+            Image.result_model_id == model_id,
+            Image.result_weights_hash == weights_hash,
+            Image.result_backend == backend,
+        )
+        .group_by(Image.image)
+        .all()
+    )
+
+
+def resolve_backend(
+    ml_model: MlModels, weights_hash: str, backend: str
+) -> Optional[ModelBackend]:
+    """Returns the backend a run with the requested one uses, None for PyTorch."""
+    if backend == BACKEND_AUTO and current_app.config["ML_BACKENDS_AUTO"]:
+        return select_backend(ml_model, weights_hash)
+    return None
+
+
+def run_inference_job(job: Job) -> None:
+    ml_model = db.session.get(MlModels, job.model_id)
+    weights_hash = model_registry.weights_hash(ml_model)
+    options = job.options or {}
+    model_backend = resolve_backend(
+        ml_model, weights_hash, options.get("backend", BACKEND_AUTO)
+    )
+    backend_name = model_backend.backend if model_backend else BACKEND_PYTORCH
+    batch_size = max(
+        options.get("batch_size") or current_app.config["INFERENCE_BATCH_SIZE"], 1
+    )
+    use_cache = options.get("mode", RUN_NEW) != RUN_FORCE
+    # With the cache, committed images already carry this model's results
+    # and are skipped on resume by themselves, so last_image_id is not needed.
+    images_to_run = get_images_to_run(
+        job.project_id,
+        job.batch_ids,
+        0 if use_cache else job.last_image_id,
+        skip_results_of=(ml_model.id, weights_hash, backend_name) if use_cache else None,
+    )
+    cached_results = (
+        find_cached_results(images_to_run, ml_model.id, weights_hash, backend_name)
+        if use_cache
+        else {}
+    )
+    results = ResultWriter(
+        model_id=ml_model.id,
+        commit_every=current_app.config["RESULTS_COMMIT_EVERY"],
+        use_copy=current_app.config["RESULTS_USE_COPY"],
+    )
+    orphans: List[str] = []
+    image_errors: List[str] = []
+    settings = _predict_settings(options.get("tiling") or TILING_AUTO, batch_size)
+    timings: Dict = {"backend": backend_name}
+    queries_before, query_seconds_before = metrics.query_stats()
+    images = _reuse_cached_results(
+        job, images_to_run, cached_results, results, orphans, timings
+    )
+    if inference_pool.enabled:
+        timings["processes"] = inference_pool.processes
+        predictions = inference_pool.predict(
+            images,
+            weights_key(model_backend.path if model_backend else ml_model.model),
+            shard_size=batch_size,
+            settings=settings,
+            timings=timings,
+        )
+    else:
+        predictions = _predict_in_process(
+            images, ml_model, model_backend, settings, timings
+        )
+    # Predictions come from worker processes or threads; this loop is the
+    # only writer of results and progress.
+    for image_batch, prediction_stats in predictions:
+        for image, stats in zip(image_batch, prediction_stats):
+            if isinstance(stats, str):
+                # Left without results, so the next run tries it again.
+                image_errors.append(f"{image.name}: {stats}")
+                timings["failed_images"] = len(image_errors)
+                job.processed += 1
+                continue
+            _release_annotated_image(image, orphans)
+            image.result_model_id = ml_model.id
+            image.result_weights_hash = weights_hash
+            image.result_backend = backend_name
+            results.add(image, stats)
+        if results.is_full() and _commit_results(job, results, orphans, timings):
+            break
+    else:
+        _commit_results(job, results, orphans, timings)
+    predictions.close()
+    if image_errors:
+        job.error = _image_errors_text(image_errors)
+    queries, query_seconds = metrics.query_stats()
+    timings["sql_queries"] = queries - queries_before
+    timings["sql_seconds"] = query_seconds - query_seconds_before
+    # Committed together with the final status of the job.
+    job.timings = _round_timings(timings)
+    current_app.logger.info("Job %s timings: %s", job.id, job.timings)
+
+
+def _predict_settings(tiling: str, batch_size: int) -> Dict:
+    config = current_app.config
+    return {
+        "batch_size": batch_size,
+        "max_pixels": config["INFERENCE_BATCH_MAX_PIXELS"],
+        "draft_decode": config["INFERENCE_DRAFT_DECODE"],
+        "tiling": tiling,
+        "tile_min_pixels": config["INFERENCE_TILE_MIN_PIXELS"],
+        "tile_size": config["INFERENCE_TILE_SIZE"],
+        "tile_overlap": config["INFERENCE_TILE_OVERLAP"],
+        "tile_nms_iou": config["INFERENCE_TILE_NMS_IOU"],
+    }
+
+
+def _predict_in_process(
+    images: Iterable[Image],
+    ml_model: MlModels,
+    model_backend: Optional[ModelBackend],
+    settings: Dict,
+    timings: Dict,
+) -> Iterator[Tuple[List[Image], List[Union[List[Tuple], str]]]]:
+    model = model_registry.get(ml_model, model_backend)
+    predict_lock = model_registry.predict_lock(ml_model, model_backend)
+    predict_seconds = 0.0
+    loader = ImageLoader(
+        images,
+        workers=current_app.config["INFERENCE_LOADER_WORKERS"],
+        prefetch=current_app.config["INFERENCE_PREFETCH_IMAGES"],
+        min_side=model_input_size(model) if settings["draft_decode"] else None,
+        load_separately=lambda image: use_tiling(
+            image.image, settings["tiling"], settings["tile_min_pixels"]
+        ),
+    )
+    with loader:
+        for image_batch in iter_image_batches(
+            loader,
+            batch_size=settings["batch_size"],
+            max_pixels=settings["max_pixels"],
+        ):
+            started = time.perf_counter()
+            if image_batch[0][1] is None:
+                prediction_stats = [
+                    _predict_separately(
+                        model, predict_lock, image_batch[0][0], loader.errors, settings
+                    )
+                ]
+            else:
+                prediction_stats = predict_arrays(
+                    model, [img_array for _, img_array in image_batch], predict_lock
+                )
+            predict_seconds += time.perf_counter() - started
+            timings.update(loader.timings(), predict_seconds=predict_seconds)
+            yield [image for image, _ in image_batch], prediction_stats
+
+
+def _predict_separately(
+    model, predict_lock, image: Image, load_errors: Dict[int, str], settings: Dict
+) -> Union[List[Tuple], str]:
+    # Tiled images and images the loader could not read come alone.
+    if image.id in load_errors:
+        return load_errors.pop(image.id)
+    try:
+        return predict_tiled(
+            model,
+            predict_lock,
+            image.image,
+            tile_size=settings["tile_size"],
+            overlap=settings["tile_overlap"],
+            batch_size=settings["batch_size"],
+            iou_threshold=settings["tile_nms_iou"],
+        )
+    except Exception as error:
+        return error_message(error)
+
+
+def _image_errors_text(image_errors: List[str]) -> str:
+    lines = [f"{len(image_errors)} image(s) could not be predicted:"]
+    lines.extend(image_errors[:MAX_IMAGE_ERRORS])
+    if len(image_errors) > MAX_IMAGE_ERRORS:
+        lines.append("...")
+    return "\n".join(lines)
+
+
+def _round_timings(timings: Dict) -> Dict:
+    return {
+        name: round(value, 3) if isinstance(value, float) else value
+        for name, value in timings.items()
+    }
+
+
+def _reuse_cached_results(
+    job: Job,
+    images: Iterable[Image],
+    cached_results: Dict[str, int],
+    results: ResultWriter,
+    orphans: List[str],
+    timings: Dict,
+) -> Iterator[Image]:
+    """Yields the images to predict, copying known results of the others."""
+    for image in images:
+        source_id = cached_results.get(image.image)
+        if source_id is None or source_id == image.id:
+            yield image
+            continue
+        source = db.session.get(Image, source_id)
+        _release_annotated_image(image, orphans)
+        image.result_model_id = source.result_model_id
+        image.result_weights_hash = source.result_weights_hash
+        image.result_backend = source.result_backend
+        results.add(
+            image,
+            db.session.query(*(getattr(Stats, column) for column in STATS_COLUMNS[2:]))
+            .filter(Stats.image_id == source_id)
+            .all(),
+        )
+        job.cache_hits += 1
+        if results.is_full() and _commit_results(job, results, orphans, timings):
+            return
+
+
+def _release_annotated_image(image: Image, orphans: List[str]) -> None:
+    # Annotated views are rendered from the detections on request; a PNG
+    # left by an older version would show stale boxes.
+    if image.annotated_image is not None:
+        orphans.extend(release_references([image.annotated_image]))
+        image.annotated_image = None
+
+
+def _commit_results(
+    job: Job, results: ResultWriter, orphans: List[str], timings: Dict
+) -> bool:
+    if results.pending:
+        job.processed += results.pending
+        job.last_image_id = results.last_image_id
+    job.heartbeat_at = datetime.now()
+    job.timings = _round_timings(timings)
+    started = time.perf_counter()
+    results.flush()
+    timings["write_seconds"] = timings.get("write_seconds", 0.0) + (
+        time.perf_counter() - started
+    )
+    remove_files(orphans)
+    orphans.clear()
+    progress.update_job(job)
+    return job.status == JOB_CANCELLING
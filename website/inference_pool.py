@@ -0,0 +1,212 @@
+import atexit
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import nullcontext
+from itertools import islice
+from multiprocessing import get_context
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from .loader import decode_image, model_input_size
+from .models import Image
+from .tiling import predict_tiled, use_tiling
+from .utils import error_message, iter_image_batches, predict_arrays
+
+# Shards in flight per worker process: one predicting, one queued.
+SHARDS_IN_FLIGHT_PER_PROCESS = 2
+# Models kept by each worker process, most recently used last.
+WORKER_MAX_MODELS = 1
+# Opt-in: every worker process holds its own model outside the registry's
+# memory budget, once per server process.
+DEFAULT_INFERENCE_PROCESSES = 1
+
+WeightsKey = Tuple[str, int]
+ShardResult = Tuple[List[Union[List[Tuple], str]], Dict[str, float]]
+
+
+def default_threads_per_process(processes: int) -> int:
+    return max((os.cpu_count() or 1) // max(processes, 1), 1)
+
+
+def weights_key(weights_path: str) -> WeightsKey:
+    """Identifies a weights file; workers reload it when it changes."""
+    return weights_path, os.stat(weights_path).st_mtime_ns
+
+
+class InferencePool:
+    """Worker processes that each hold their own loaded model.
+
+    Images are sent to the workers in shards of storage paths; each worker
+    decodes and predicts its shard and returns only the detection rows, so
+    a single writer in the job thread persists every result.
+    """
+
+    def __init__(self, app=None):
+        self.processes = 1
+        self.threads = 1
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.processes = app.config.setdefault(
+            "INFERENCE_PROCESSES", DEFAULT_INFERENCE_PROCESSES
+        )
+        self.threads = app.config.setdefault(
+            "INFERENCE_THREADS_PER_PROCESS", None
+        ) or default_threads_per_process(self.processes)
+        app.extensions["inference_pool"] = self
+
+    @property
+    def enabled(self) -> bool:
+        return self.processes > 1
+
+    def predict(
+        self,
+        images: Iterable[Image],
+        weights: WeightsKey,
+        shard_size: int,
+        settings: Dict,
+        timings: Dict[str, float],
+    ) -> Iterator[Tuple[List[Image], List[Union[List[Tuple], str]]]]:
+        """Yields ``(images, prediction_stats)`` per shard in input order.
+
+        The stats of an image that failed are its error message.
+
+        ``timings`` is updated with the decode and predict seconds spent in
+        the workers and the time spent waiting for them.
+        """
+        executor = self._get_executor()
+        images = iter(images)
+        pending: "deque[Tuple[List[Image], Future]]" = deque()
+        try:
+            while shard := list(islice(images, max(shard_size, 1))):
+                pending.append(
+                    (
+                        shard,
+                        executor.submit(
+                            predict_shard,
+                            weights,
+                            [image.image for image in shard],
+                            settings,
+                        ),
+                    )
+                )
+                if len(pending) >= SHARDS_IN_FLIGHT_PER_PROCESS * self.processes:
+                    yield self._next(pending, timings)
+            while pending:
+                yield self._next(pending, timings)
+        finally:
+            for _, future in pending:
+                future.cancel()
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+                self._executor = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # Forking a process that runs threads (and maybe a loaded
+                # model) is unsafe, so the workers start from scratch.
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.processes,
+                    mp_context=get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(self.threads,),
+                )
+                atexit.register(self.shutdown)
+            return self._executor
+
+    def _next(
+        self, pending: deque, timings: Dict[str, float]
+    ) -> Tuple[List[Image], List[Union[List[Tuple], str]]]:
+        shard, future = pending.popleft()
+        started = time.perf_counter()
+        try:
+            prediction_stats, shard_timings = future.result()
+        except BrokenProcessPool:
+            # A worker died (e.g. out of memory); start a new pool next time.
+            with self._lock:
+                self._executor = None
+            raise
+        timings["predict_wait_seconds"] = timings.get(
+            "predict_wait_seconds", 0.0
+        ) + (time.perf_counter() - started)
+        for name, value in shard_timings.items():
+            timings[name] = timings.get(name, 0) + value
+        return shard, prediction_stats
+
+
+_worker_models: "OrderedDict[WeightsKey, object]" = OrderedDict()
+
+
+def _init_worker(threads: int) -> None:
+    import torch
+
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(1)
+
+
+def _worker_model(weights: WeightsKey):
+    from ultralytics import YOLO
+
+    if weights not in _worker_models:
+        _worker_models[weights] = YOLO(weights[0], task="detect")
+        while len(_worker_models) > WORKER_MAX_MODELS:
+            _worker_models.popitem(last=False)
+    _worker_models.move_to_end(weights)
+    return _worker_models[weights]
+
+
+def predict_shard(
+    weights: WeightsKey, image_paths: List[str], settings: Dict
+) -> ShardResult:
+    """Runs in a worker process; returns detections of each image in order.
+
+    An image that cannot be read or predicted gets its error message.
+    """
+    model = _worker_model(weights)
+    min_side = model_input_size(model) if settings["draft_decode"] else None
+    timings = {"decoded": 0, "decode_seconds": 0.0, "predict_seconds": 0.0}
+    prediction_stats: List[Union[List[Tuple], str, None]] = [None] * len(image_paths)
+    pairs = []
+    for index, image_path in enumerate(image_paths):
+        started = time.perf_counter()
+        try:
+            if use_tiling(image_path, settings["tiling"], settings["tile_min_pixels"]):
+                prediction_stats[index] = predict_tiled(
+                    model,
+                    nullcontext(),
+                    image_path,
+                    tile_size=settings["tile_size"],
+                    overlap=settings["tile_overlap"],
+                    batch_size=settings["batch_size"],
+                    iou_threshold=settings["tile_nms_iou"],
+                )
+                timings["predict_seconds"] += time.perf_counter() - started
+                continue
+            pairs.append((index, decode_image(image_path, min_side)))
+        except Exception as error:
+            prediction_stats[index] = error_message(error)
+            continue
+        timings["decode_seconds"] += time.perf_counter() - started
+        timings["decoded"] += 1
+    for batch in iter_image_batches(
+        pairs, batch_size=settings["batch_size"], max_pixels=settings["max_pixels"]
+    ):
+        started = time.perf_counter()
+        batch_stats = predict_arrays(model, [img_array for _, img_array in batch])
+        timings["predict_seconds"] += time.perf_counter() - started
+        for (index, _), stats in zip(batch, batch_stats):
+            prediction_stats[index] = stats
+    return prediction_stats, timings
+
+
+inference_pool = InferencePool()
@@ -0,0 +1,255 @@
+import threading
+import traceback
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Set
+
+from . import db
+from .metrics import metrics
+from .progress import progress
+from .models import (
+    Job,
+    JOB_QUEUED,
+    JOB_RUNNING,
+    JOB_CANCELLING,
+    JOB_CANCELLED,
+    JOB_FAILED,
+    JOB_DONE,
+)
+
+DEFAULT_JOB_WORKERS = 1
+DEFAULT_JOB_POLL_INTERVAL = 2.0
+DEFAULT_JOB_STALE_AFTER = 600
+DEFAULT_JOB_HEARTBEAT_INTERVAL = 30.0
+
+
+class JobWorkerPool:
+    """Threads that pull queued jobs from the ``job`` table and run them.
+
+    Jobs are claimed with a conditional UPDATE, so several pools (e.g. one
+    per server process) can share one database without an external broker.
+    While a job runs, a heartbeat thread refreshes its ``heartbeat_at``, so
+    a job only looks stale once its worker is gone.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._threads: List[threading.Thread] = []
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._running: Set[int] = set()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.config.setdefault("JOB_WORKERS", DEFAULT_JOB_WORKERS)
+        app.config.setdefault("JOB_POLL_INTERVAL", DEFAULT_JOB_POLL_INTERVAL)
+        app.config.setdefault("JOB_STALE_AFTER", DEFAULT_JOB_STALE_AFTER)
+        app.config.setdefault("JOB_HEARTBEAT_INTERVAL", DEFAULT_JOB_HEARTBEAT_INTERVAL)
+        app.extensions["job_workers"] = self
+
+    def start(self) -> None:
+        self._stop.clear()
+        for n in range(self.app.config["JOB_WORKERS"] - len(self._threads)):
+            thread = threading.Thread(
+                target=self._work, name=f"job-worker-{n}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def notify(self) -> None:
+        self._wake.set()
+
+    def is_running(self, job_id: int) -> bool:
+        return job_id in self._running
+
+    def _work(self) -> None:
+        while not self._stop.is_set():
+            job = None
+            with self.app.app_context():
+                try:
+                    job = claim_next_job()
+                    if job is not None:
+                        with self._heartbeat(job.id):
+                            execute_job(job)
+                except Exception:
+                    self.app.logger.exception("Job worker failed")
+                finally:
+                    db.session.remove()
+            if job is None:
+                self._wake.wait(self.app.config["JOB_POLL_INTERVAL"])
+                self._wake.clear()
+
+    @contextmanager
+    def _heartbeat(self, job_id: int) -> Iterator[None]:
+        stop = threading.Event()
+        thread = threading.Thread(
+            target=self._beat, args=(job_id, stop), name=f"job-heartbeat-{job_id}"
+        )
+        self._running.add(job_id)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+            self._running.discard(job_id)
+
+    def _beat(self, job_id: int, stop: threading.Event) -> None:
+        # A tiled slide can take longer than JOB_STALE_AFTER between two
+        # result commits, so the heartbeat does not wait for them.
+        while not stop.wait(self.app.config["JOB_HEARTBEAT_INTERVAL"]):
+            with self.app.app_context():
+                try:
+                    db.session.query(Job).filter(
+                        Job.id == job_id,
+                        Job.status.in_((JOB_RUNNING, JOB_CANCELLING)),
+                    ).update(
+                        {"heartbeat_at": datetime.now()}, synchronize_session=False
+                    )
+                    db.session.commit()
+                except Exception:
+                    self.app.logger.exception("Job heartbeat failed")
+                finally:
+                    db.session.remove()
+
+
+def submit_job(
+    user_id: Optional[int],
+    project_id: int,
+    model_id: int,
+    batch_ids: List[int],
+    total: int,
+    options: Optional[Dict] = None,
+    cache_hits: int = 0,
+) -> Job:
+    job = Job(
+        user_id=user_id,
+        project_id=project_id,
+        model_id=model_id,
+        batch_ids=batch_ids,
+        options=options or {},
+        status=JOB_QUEUED,
+        processed=0,
+        total=total,
+        cache_hits=cache_hits,
+        last_image_id=0,
+        created_at=datetime.now(),
+    )
+    db.session.add(job)
+    db.session.commit()
+    job_workers.notify()
+    return job
+
+
+def claim_next_job() -> Optional[Job]:
+    candidates = (
+        db.session.query(Job.id)
+        .filter(Job.status == JOB_QUEUED)
+        .order_by(Job.id)
+        .limit(5)
+        .all()
+    )
+    for (job_id,) in candidates:
+        claimed = (
+            db.session.query(Job)
+            .filter(Job.id == job_id, Job.status == JOB_QUEUED)
+            .update(
+                {
+                    "status": JOB_RUNNING,
+                    "started_at": datetime.now(),
+                    "heartbeat_at": datetime.now(),
+                },
+                synchronize_session=False,
+            )
+        )
+        db.session.commit()
+        if claimed:
+            return db.session.get(Job, job_id)
+    return None
+
+
+def execute_job(job: Job) -> None:
+    from .inference import run_inference_job
+
+    progress.start_job(job)
+    try:
+        run_inference_job(job)
+    except Exception:
+        db.session.rollback()
+        job.status = JOB_FAILED
+        job.error = traceback.format_exc()
+    else:
+        job.status = JOB_CANCELLED if job.status == JOB_CANCELLING else JOB_DONE
+    job.finished_at = datetime.now()
+    db.session.commit()
+    metrics.record_job(job.timings, job.status)
+    progress.finish_job(job)
+
+
+def cancel_job(job: Job) -> bool:
+    if job.status == JOB_QUEUED:
+        job.status = JOB_CANCELLED
+        job.finished_at = datetime.now()
+    elif job.status == JOB_RUNNING:
+        job.status = JOB_CANCELLING
+    else:
+        return False
+    db.session.commit()
+    return True
+
+
+def resume_job(job: Job) -> bool:
+    if not (job.status in (JOB_FAILED, JOB_CANCELLED) or is_stale(job)):
+        return False
+    # A job of this process whose heartbeat is late is still being run.
+    if job_workers.is_running(job.id):
+        return False
+    job.status = JOB_QUEUED
+    job.error = None
+    job.finished_at = None
+    db.session.commit()
+    job_workers.notify()
+    return True
+
+
+def is_stale(job: Job) -> bool:
+    stale_after = timedelta(seconds=job_workers.app.config["JOB_STALE_AFTER"])
+    return (
+        job.status in (JOB_RUNNING, JOB_CANCELLING)
+        and job.heartbeat_at is not None
+        and datetime.now() - job.heartbeat_at.replace(tzinfo=None) > stale_after
+    )
+
+
+def job_to_dict(job: Job) -> Dict:
+    return {
+        "id": job.id,
+        "project_id": job.project_id,
+        "model_id": job.model_id,
+        "batch_ids": job.batch_ids,
+        "status": job.status,
+        "processed": job.processed,
+        "total": job.total,
+        "cache_hits": job.cache_hits,
+        "timings": job.timings,
+        "error": job.error,
+        "created_at": _isoformat(job.created_at),
+        "started_at": _isoformat(job.started_at),
+        "finished_at": _isoformat(job.finished_at),
+    }
+
+
+def _isoformat(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value is not None else None
+
+
+job_workers = JobWorkerPool()
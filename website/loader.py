@@ -0,0 +1,114 @@
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+import numpy as np
+from PIL import Image as PILImage
+
+from .models import Image
+from .storage import storage_path
+from .utils import error_message
+
+DEFAULT_MODEL_INPUT_SIZE = 640
+
+
+def model_input_size(model) -> int:
+    imgsz = getattr(model, "overrides", {}).get("imgsz") or DEFAULT_MODEL_INPUT_SIZE
+    return max(imgsz) if isinstance(imgsz, (list, tuple)) else int(imgsz)
+
+
+def decode_image(image_path: str, min_side: Optional[int] = None) -> np.ndarray:
+    with PILImage.open(storage_path(image_path)) as image:
+        if min_side is not None:
+            # JPEG decodes at 1/2, 1/4 or 1/8 scale when that still covers
+            # min_side; boxes are normalized, so nothing else changes.
+            image.draft(image.mode, (min_side, min_side))
+        return np.array(image)
+
+
+class ImageLoader:
+    """Decodes images in a thread pool ahead of inference.
+
+    Iterating yields ``(image, array)`` pairs in the order of ``images``,
+    with at most ``prefetch`` images decoded or in flight. Images picked
+    by ``load_separately`` are not decoded and come with ``None``, as do
+    images that cannot be read; their error is kept in ``errors`` by id.
+    """
+
+    def __init__(
+        self,
+        images: Iterable[Image],
+        workers: int,
+        prefetch: int,
+        min_side: Optional[int] = None,
+        load_separately: Optional[Callable[[Image], bool]] = None,
+    ):
+        self.images = images
+        self.prefetch = max(prefetch, 1)
+        self.min_side = min_side
+        self.load_separately = load_separately
+        self.decode_seconds = 0.0
+        self.wait_seconds = 0.0
+        self.decoded = 0
+        self.errors: Dict[int, str] = {}
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(workers, 1), thread_name_prefix="image-loader"
+        )
+
+    def __enter__(self) -> "ImageLoader":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def __iter__(self) -> Iterator[Tuple[Image, Optional[np.ndarray]]]:
+        pending = deque()
+        for image in self.images:
+            try:
+                separately = (
+                    self.load_separately is not None and self.load_separately(image)
+                )
+            except Exception as error:
+                self.errors[image.id] = error_message(error)
+                separately = True
+            if separately:
+                future = None
+            else:
+                future = self._executor.submit(self._decode, image.image)
+            pending.append((image, future))
+            if len(pending) >= self.prefetch:
+                yield self._next(pending)
+        while pending:
+            yield self._next(pending)
+
+    def timings(self) -> Dict[str, float]:
+        return {
+            "decoded": self.decoded,
+            "decode_seconds": round(self.decode_seconds, 3),
+            "decode_wait_seconds": round(self.wait_seconds, 3),
+        }
+
+    def _next(self, pending: deque) -> Tuple[Image, Optional[np.ndarray]]:
+        image, future = pending.popleft()
+        if future is None:
+            return image, None
+        started = time.perf_counter()
+        try:
+            img_array, decode_seconds = future.result()
+        except Exception as error:
+            self.errors[image.id] = error_message(error)
+            return image, None
+        finally:
+            self.wait_seconds += time.perf_counter() - started
+        self.decode_seconds += decode_seconds
+        self.decoded += 1
+        return image, img_array
+
+    def _decode(self, image_path: str) -> Tuple[np.ndarray, float]:
+        started = time.perf_counter()
+        img_array = decode_image(image_path, self.min_side)
+        return img_array, time.perf_counter() - started
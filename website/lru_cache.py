@@ -0,0 +1,68 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+
+class LRUCache:
+    """Thread-safe LRU cache bounded by its entry count or total size.
+
+    With ``max_bytes``, values are ``bytes``/``str`` and weigh their length;
+    a value larger than the whole budget is not cached. Callers put the
+    project's data version in their keys, so entries of stale data are
+    never served and age out of the LRU.
+    """
+
+    def __init__(
+        self, max_entries: Optional[int] = None, max_bytes: Optional[int] = None
+    ):
+        self._entries: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._size = 0
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if self.max_bytes is not None and len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._size -= self._weight(self._entries[key])
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            self._size += self._weight(value)
+            while self._over_budget():
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= self._weight(evicted)
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            stats = {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+            if self.max_bytes is not None:
+                stats["bytes"] = self._size
+            return stats
+
+    def _weight(self, value: Any) -> int:
+        return len(value) if self.max_bytes is not None else 0
+
+    def _over_budget(self) -> bool:
+        if self.max_entries is not None and len(self._entries) > self.max_entries:
+            return True
+        return self.max_bytes is not None and self._size > self.max_bytes
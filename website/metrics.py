@@ -0,0 +1,258 @@
+import hmac
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from flask import Response, abort, current_app, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+METRICS_MIMETYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+# Stages of the inference loop as recorded in Job.timings.
+INFERENCE_STAGES = ("decode", "decode_wait", "predict_wait", "predict", "write")
+# Registry and cache statistics that only ever grow.
+MONOTONIC_STATS = ("hits", "misses", "evictions", "load_seconds")
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class _Histogram:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        for n, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[n] += 1
+        self.count += 1
+        self.sum += value
+
+
+class _QueryStats(threading.local):
+    queries = 0
+    seconds = 0.0
+
+
+class Metrics:
+    """Process-wide counters and histograms exported in Prometheus text format.
+
+    SQL statements are counted per thread through engine events, so every
+    request (and job) can report its own query count and database time.
+    """
+
+    def __init__(self, app=None):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[Labels, float]] = defaultdict(dict)
+        self._histograms: Dict[str, Dict[Labels, _Histogram]] = defaultdict(dict)
+        self._help: Dict[str, Tuple[str, str]] = {}
+        self._queries = _QueryStats()
+        self._listening = False
+        self.log_requests = False
+        self.token: Optional[str] = None
+        self.startup_seconds: Optional[float] = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.log_requests = app.config.setdefault("METRICS_LOG_REQUESTS", False)
+        # /metrics answers 404 until a bearer token for the scraper is set.
+        self.token = app.config.setdefault("METRICS_TOKEN", None)
+        if not self._listening:
+            event.listen(Engine, "before_cursor_execute", self._before_cursor_execute)
+            event.listen(Engine, "after_cursor_execute", self._after_cursor_execute)
+            self._listening = True
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.add_url_rule("/metrics", "metrics", self.render)
+        app.extensions["metrics"] = self
+
+    def inc(self, name: str, value: float = 1, help: str = "", **labels) -> None:
+        key = _labels(labels)
+        with self._lock:
+            self._help.setdefault(name, ("counter", help))
+            self._counters[name][key] = self._counters[name].get(key, 0) + value
+
+    def observe(
+        self,
+        name: str,
+        value: float,
+        buckets: Tuple[float, ...] = LATENCY_BUCKETS,
+        help: str = "",
+        **labels,
+    ) -> None:
+        key = _labels(labels)
+        with self._lock:
+            self._help.setdefault(name, ("histogram", help))
+            histogram = self._histograms[name].get(key)
+            if histogram is None:
+                histogram = self._histograms[name][key] = _Histogram(buckets)
+            histogram.observe(value)
+
+    def query_stats(self) -> Tuple[int, float]:
+        """SQL statements and seconds spent in them by the current thread."""
+        return self._queries.queries, self._queries.seconds
+
+    def record_job(self, timings: Optional[Dict], status: str) -> None:
+        self.inc("wbc_jobs_total", help="Finished inference jobs.", status=status)
+        for stage in INFERENCE_STAGES:
+            seconds = (timings or {}).get(f"{stage}_seconds")
+            if seconds:
+                self.inc(
+                    "wbc_inference_stage_seconds_total",
+                    seconds,
+                    help="Time spent in each stage of the inference loop.",
+                    stage=stage,
+                )
+
+    def render(self) -> Response:
+        if not self.token:
+            abort(404)
+        expected = f"Bearer {self.token}"
+        if not hmac.compare_digest(request.headers.get("Authorization", ""), expected):
+            abort(401)
+        counters, gauges = _stats()
+        if self.startup_seconds is not None:
+            gauges.append(
+                ("wbc_startup_seconds", "Time to create the app.", self.startup_seconds)
+            )
+        return Response(
+            "".join(self._render_lines(counters, gauges)), mimetype=METRICS_MIMETYPE
+        )
+
+    def _render_lines(
+        self,
+        stat_counters: Iterable[Tuple[str, str, float]],
+        gauges: Iterable[Tuple[str, str, float]],
+    ) -> List[str]:
+        lines = []
+        with self._lock:
+            for name, values in sorted(self._counters.items()):
+                lines.extend(_header(name, *self._help[name]))
+                for labels, value in sorted(values.items()):
+                    lines.append(f"{name}{_format_labels(labels)} {value}\n")
+            for name, values in sorted(self._histograms.items()):
+                lines.extend(_header(name, *self._help[name]))
+                for labels, histogram in sorted(values.items()):
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        bucket = labels + (("le", _format_value(bound)),)
+                        lines.append(f"{name}_bucket{_format_labels(bucket)} {count}\n")
+                    bucket = labels + (("le", "+Inf"),)
+                    lines.append(f"{name}_bucket{_format_labels(bucket)} {histogram.count}\n")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}\n")
+                    lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}\n")
+        for kind, values in (("counter", stat_counters), ("gauge", gauges)):
+            for name, help, value in values:
+                lines.extend(_header(name, kind, help))
+                lines.append(f"{name} {value}\n")
+        return lines
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        self._queries.queries += 1
+        self._queries.seconds += time.perf_counter() - started
+
+    def _before_request(self) -> None:
+        g.metrics_started = (time.perf_counter(), *self.query_stats())
+
+    def _after_request(self, response: Response) -> Response:
+        started = g.pop("metrics_started", None)
+        if started is None or request.endpoint == "metrics":
+            return response
+        seconds = time.perf_counter() - started[0]
+        queries, query_seconds = self.query_stats()
+        queries -= started[1]
+        query_seconds -= started[2]
+        endpoint = request.endpoint or "unknown"
+        self.inc(
+            "wbc_http_requests_total",
+            help="HTTP requests by endpoint, method and status.",
+            endpoint=endpoint,
+            method=request.method,
+            status=str(response.status_code),
+        )
+        self.observe(
+            "wbc_http_request_seconds",
+            seconds,
+            help="Time to produce the response (streamed bodies excluded).",
+            endpoint=endpoint,
+        )
+        self.observe(
+            "wbc_http_request_sql_queries",
+            queries,
+            buckets=QUERY_COUNT_BUCKETS,
+            help="SQL statements executed per request.",
+            endpoint=endpoint,
+        )
+        self.observe(
+            "wbc_http_request_sql_seconds",
+            query_seconds,
+            help="Time spent in SQL statements per request.",
+            endpoint=endpoint,
+        )
+        if self.log_requests:
+            current_app.logger.info(
+                "%s %s %s %.1f ms, %d queries, %.1f ms SQL",
+                request.method,
+                request.path,
+                response.status_code,
+                1000 * seconds,
+                queries,
+                1000 * query_seconds,
+            )
+        return response
+
+
+def _stats() -> Tuple[List[Tuple[str, str, float]], List[Tuple[str, str, float]]]:
+    """Counters and gauges of the model registry and the caches."""
+    from .annotations import annotation_cache
+    from .chart_cache import chart_cache
+    from .model_registry import model_registry
+
+    counters, gauges = [], []
+    for prefix, help, stats in (
+        ("wbc_model_registry", "Loaded models", model_registry.stats()),
+        ("wbc_chart_cache", "Chart cache", chart_cache.stats()),
+        ("wbc_annotation_cache", "Annotated image cache", annotation_cache.stats()),
+    ):
+        for name, value in stats.items():
+            if value is None:
+                continue
+            if name in MONOTONIC_STATS:
+                counters.append((f"{prefix}_{name}_total", f"{help}: {name}.", value))
+            else:
+                gauges.append((f"{prefix}_{name}", f"{help}: {name}.", value))
+    return counters, gauges
+
+
+def _labels(labels: Dict[str, str]) -> Labels:
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    return str(float(value))
+
+
+def _header(name: str, kind: str, help: str) -> List[str]:
+    return [f"# HELP {name} {help}\n", f"# TYPE {name} {kind}\n"]
+
+
+metrics = Metrics()
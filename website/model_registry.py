@@ -0,0 +1,217 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import psutil
+
+from . import db
+
+DEFAULT_MAX_LOADED_MODELS = 2
+WARMUP_IMAGE_SIZE = 64
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class ModelRegistry:
+    """Process-wide cache of loaded YOLO models backed by the ``models`` table.
+
+    Models are loaded once, kept in LRU order and evicted when either the
+    number of resident models or their estimated memory exceeds the limits
+    set in the app config.
+    """
+
+    def __init__(self, app=None):
+        # Keyed by (model id, backend id); backend id None is the .pt file.
+        self._models: "OrderedDict[Tuple[int, Optional[int]], tuple]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._predict_locks: Dict[Tuple[int, Optional[int]], threading.Lock] = {}
+        self._weights_hashes: Dict[int, Tuple[tuple, str]] = {}
+        self.max_loaded = DEFAULT_MAX_LOADED_MODELS
+        self.memory_budget = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.load_seconds = 0.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.max_loaded = app.config.setdefault(
+            "ML_MODELS_MAX_LOADED", DEFAULT_MAX_LOADED_MODELS
+        )
+        budget_mb = app.config.setdefault("ML_MODELS_MEMORY_BUDGET_MB", None)
+        self.memory_budget = budget_mb * 1024 * 1024 if budget_mb else None
+        app.config.setdefault("ML_MODELS_PRELOAD", [])
+        app.config.setdefault("ML_MODELS_WARMUP", True)
+        app.extensions["model_registry"] = self
+
+    def get(self, ml_model, backend=None):
+        key = _model_key(ml_model, backend)
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                self.hits += 1
+                return self._models[key][0]
+            self.misses += 1
+            model, size = self._load(
+                ml_model.model if backend is None else backend.path
+            )
+            self._models[key] = (model, size)
+            self._evict()
+        if ml_model.class_names is None:
+            # Normally stored by `flask models sync`; flushed here and
+            # committed with the caller's transaction.
+            ml_model.class_names = class_names_json(model.names)
+            db.session.flush()
+        return model
+
+    def get_by_name(self, name: str):
+        from .models import MlModels
+
+        ml_model = MlModels.query.filter_by(name=name).first()
+        if ml_model is None:
+            return None
+        return self.get(ml_model)
+
+    def predict_lock(self, ml_model, backend=None) -> threading.Lock:
+        # YOLO predictors keep per-call state, so a shared model must not
+        # be used by two threads at once.
+        with self._lock:
+            return self._predict_locks.setdefault(
+                _model_key(ml_model, backend), threading.Lock()
+            )
+
+    def weights_hash(self, ml_model) -> str:
+        """SHA-256 of the weights file, rehashed only when the file changes.
+
+        A changed hash is flushed to ``ml_model`` and committed with the
+        caller's transaction.
+        """
+        stat = os.stat(ml_model.model)
+        signature = (ml_model.model, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._weights_hashes.get(ml_model.id)
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        digest = hashlib.sha256()
+        with open(ml_model.model, "rb") as weights:
+            while chunk := weights.read(HASH_CHUNK_SIZE):
+                digest.update(chunk)
+        weights_hash = digest.hexdigest()
+        with self._lock:
+            self._weights_hashes[ml_model.id] = (signature, weights_hash)
+            if cached is not None:
+                # The file was replaced, drop the models loaded from the old one.
+                self._evict_model(ml_model.id)
+        if ml_model.weights_hash != weights_hash:
+            if ml_model.weights_hash is not None:
+                ml_model.class_names = None
+            ml_model.weights_hash = weights_hash
+            db.session.flush()
+        return weights_hash
+
+    def class_names(self, ml_model) -> Dict[int, str]:
+        if ml_model.class_names is None:
+            self.get(ml_model)
+        return {int(k): v for k, v in ml_model.class_names.items()}
+
+    def preload(self, app):
+        from .models import MlModels
+
+        with app.app_context():
+            for name in app.config["ML_MODELS_PRELOAD"]:
+                ml_model = MlModels.query.filter_by(name=name).first()
+                if ml_model is None:
+                    app.logger.warning("Cannot preload unknown model %s", name)
+                    continue
+                model = self.get(ml_model)
+                if app.config["ML_MODELS_WARMUP"]:
+                    warm_up(model)
+
+    def evict(self, model_id: int) -> None:
+        with self._lock:
+            self._evict_model(model_id)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._models.clear()
+
+    def stats(self) -> Dict[str, Optional[float]]:
+        with self._lock:
+            return {
+                "loaded": len(self._models),
+                "memory_bytes": self._memory_used(),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "load_seconds": round(self.load_seconds, 3),
+            }
+
+    def _load(self, weights_path: str):
+        from ultralytics import YOLO
+
+        process = psutil.Process()
+        rss_before = process.memory_info().rss
+        started = time.perf_counter()
+        model = YOLO(weights_path, task="detect")
+        self.load_seconds += time.perf_counter() - started
+        rss_delta = process.memory_info().rss - rss_before
+        return model, max(rss_delta, _path_size(weights_path))
+
+    def _evict_model(self, model_id: int) -> None:
+        for key in [key for key in self._models if key[0] == model_id]:
+            del self._models[key]
+
+    def _memory_used(self) -> int:
+        return sum(size for _, size in self._models.values())
+
+    def _evict(self) -> None:
+        while len(self._models) > 1 and (
+            len(self._models) > self.max_loaded
+            or (
+                self.memory_budget is not None
+                and self._memory_used() > self.memory_budget
+            )
+        ):
+            self._models.popitem(last=False)
+            self.evictions += 1
+
+
+def _model_key(ml_model, backend=None) -> Tuple[int, Optional[int]]:
+    return ml_model.id, backend.id if backend is not None else None
+
+
+def _path_size(path: str) -> int:
+    if os.path.isdir(path):
+        return sum(
+            os.path.getsize(os.path.join(root, name))
+            for root, _, names in os.walk(path)
+            for name in names
+        )
+    return os.path.getsize(path)
+
+
+def warm_up(model) -> None:
+    model.predict(
+        np.zeros((WARMUP_IMAGE_SIZE, WARMUP_IMAGE_SIZE, 3), dtype=np.uint8),
+        stream=False,
+        save=False,
+        verbose=False,
+    )
+
+
+def class_names_json(names: Dict[int, str]) -> Dict[str, str]:
+    return {str(k): v for k, v in names.items()}
+
+
+def read_class_names(weights_path: str) -> Dict[str, str]:
+    """Class names of a weights file, read without keeping the model."""
+    from ultralytics import YOLO
+
+    return class_names_json(YOLO(weights_path, task="detect").names)
+
+
+model_registry = ModelRegistry()
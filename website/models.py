@@ -22,9 +22,10 @@ class User(db.Model, UserMixin):
 class Project(db.Model):
     __tablename__ = 'project'
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'))
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), index=True)
     name = db.Column(db.String(100))
     date = db.Column(db.DateTime(timezone=True))
+    data_version = db.Column(db.Integer, default=0, server_default='0', nullable=False)
     batch_r = relationship(
         'Batch',
         back_populates='project',
@@ -46,8 +47,9 @@ class Project(db.Model):
 class Batch(db.Model):
     __tablename__ = 'batch'
     id = db.Column(db.Integer, primary_key=True)
-    project_id = db.Column(db.Integer, db.ForeignKey('project.id', ondelete='CASCADE'))
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id', ondelete='CASCADE'), index=True)
     name = db.Column(db.String(100))
+    image_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
     project = relationship(
         'Project',
         back_populates='batch_r',
@@ -62,6 +64,10 @@ class Batch(db.Model):
 
 class Image(db.Model):
     __tablename__ = 'image'
+    __table_args__ = (
+        db.Index('ix_image_project_id_batch_id_date_id', 'project_id', 'batch_id', 'date', 'id'),
+        db.Index('ix_image_image_result', 'image', 'result_model_id', 'result_weights_hash', 'result_backend'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     project_id = db.Column(db.Integer, db.ForeignKey('project.id', ondelete='CASCADE'))
     batch_id = db.Column(db.Integer, db.ForeignKey('batch.id', ondelete='CASCADE'))
@@ -69,6 +75,9 @@ class Image(db.Model):
     date = db.Column(db.DateTime(timezone=True))
     image = db.Column(db.String(1000))
     annotated_image = db.Column(db.String(1000), default=None)
+    result_model_id = db.Column(db.Integer, db.ForeignKey('models.id', ondelete='SET NULL'), default=None)
+    result_weights_hash = db.Column(db.String(64), default=None)
+    result_backend = db.Column(db.String(32), default=None)
     project = relationship(
         'Project',
         back_populates='image_r',
@@ -88,21 +97,111 @@ class Image(db.Model):
 class Stats(db.Model):
     __tablename__ = 'stats'
     id = db.Column(db.Integer, primary_key=True)
-    image_id = db.Column(db.Integer, db.ForeignKey('image.id', ondelete='CASCADE'))
+    image_id = db.Column(db.Integer, db.ForeignKey('image.id', ondelete='CASCADE'), index=True)
+    model_id = db.Column(db.Integer, db.ForeignKey('models.id', ondelete='SET NULL'))
     class_id = db.Column(db.Integer)
     class_name = db.Column(db.String(100), default="Unknown")
-    box_coords = db.Column(db.String(100))
+    x = db.Column(db.Float)
+    y = db.Column(db.Float)
+    w = db.Column(db.Float)
+    h = db.Column(db.Float)
+    confidence = db.Column(db.Float)
     image = relationship(
         'Image',
         back_populates='stats_r',
     )
 
 
+class BatchClassCount(db.Model):
+    __tablename__ = 'batch_class_count'
+    __table_args__ = (
+        db.UniqueConstraint('batch_id', 'class_name'),
+        db.Index('ix_batch_class_count_project_id_class_name', 'project_id', 'class_name'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id', ondelete='CASCADE'))
+    batch_id = db.Column(db.Integer, db.ForeignKey('batch.id', ondelete='CASCADE'))
+    class_name = db.Column(db.String(100))
+    count = db.Column(db.Integer, default=0)
+
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_CANCELLING = "cancelling"
+JOB_CANCELLED = "cancelled"
+JOB_FAILED = "failed"
+JOB_DONE = "done"
+
+
+class Job(db.Model):
+    __tablename__ = 'job'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'))
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id', ondelete='CASCADE'), index=True)
+    model_id = db.Column(db.Integer, db.ForeignKey('models.id', ondelete='CASCADE'))
+    batch_ids = db.Column(db.JSON)
+    options = db.Column(db.JSON, default=dict)
+    status = db.Column(db.String(20), default=JOB_QUEUED, index=True)
+    processed = db.Column(db.Integer, default=0)
+    total = db.Column(db.Integer, default=0)
+    last_image_id = db.Column(db.Integer, default=0)
+    cache_hits = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    timings = db.Column(db.JSON, default=None)
+    error = db.Column(db.Text, default=None)
+    created_at = db.Column(db.DateTime(timezone=True))
+    started_at = db.Column(db.DateTime(timezone=True), default=None)
+    finished_at = db.Column(db.DateTime(timezone=True), default=None)
+    heartbeat_at = db.Column(db.DateTime(timezone=True), default=None)
+
+
+class StoredFile(db.Model):
+    __tablename__ = 'stored_file'
+    path = db.Column(db.String(1000), primary_key=True)
+    size = db.Column(db.BigInteger)
+    refcount = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+
+
+class ChunkedUpload(db.Model):
+    __tablename__ = 'chunked_upload'
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'))
+    project_id = db.Column(db.Integer, db.ForeignKey('project.id', ondelete='CASCADE'))
+    batch_id = db.Column(db.Integer, db.ForeignKey('batch.id', ondelete='CASCADE'))
+    filename = db.Column(db.String(100))
+    size = db.Column(db.BigInteger)
+    received = db.Column(db.BigInteger, default=0)
+    created_at = db.Column(db.DateTime(timezone=True))
+
+
+BACKEND_EXPORTED = "exported"
+BACKEND_VERIFIED = "verified"
+BACKEND_REJECTED = "rejected"
+
+
+class ModelBackend(db.Model):
+    __tablename__ = 'model_backend'
+    __table_args__ = (
+        db.UniqueConstraint('model_id', 'backend'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    model_id = db.Column(db.Integer, db.ForeignKey('models.id', ondelete='CASCADE'), index=True)
+    backend = db.Column(db.String(20))
+    path = db.Column(db.String(500))
+    weights_hash = db.Column(db.String(64))
+    status = db.Column(db.String(20), default=BACKEND_EXPORTED)
+    latency_ms = db.Column(db.Float, default=None)
+    metrics = db.Column(db.JSON, default=None)
+    created_at = db.Column(db.DateTime(timezone=True))
+    verified_at = db.Column(db.DateTime(timezone=True), default=None)
+
+
 class MlModels(db.Model):
     __tablename__ = 'models'
     id = db.Column(db.Integer, primary_key=True)
     model = db.Column(db.String(500))
     name = db.Column(db.String(100))
+    class_names = db.Column(db.JSON, default=None)
+    weights_hash = db.Column(db.String(64), default=None)
 
 
 # @event.listens_for(MlModels.__table__, 'after_create')
@@ -0,0 +1,188 @@
+import threading
+import time
+import uuid
+from typing import Dict, Optional
+
+from flask import request
+from flask_login import current_user
+from flask_socketio import join_room
+
+from . import db, socket
+from .models import Job, JOB_QUEUED, JOB_RUNNING, JOB_CANCELLING
+
+DEFAULT_PROGRESS_MAX_RATE = 2.0
+JOB_PROGRESS_EVENT = "job progress"
+UPLOAD_PROGRESS_EVENT = "upload progress"
+ACTIVE_JOB_STATUSES = (JOB_QUEUED, JOB_RUNNING, JOB_CANCELLING)
+
+
+def user_room(user_id: int) -> str:
+    return f"user:{user_id}"
+
+
+def job_room(job_id: int) -> str:
+    return f"job:{job_id}"
+
+
+class ProgressTracker:
+    """Progress of one job or upload, sent to a Socket.IO room.
+
+    Updates are coalesced to one event per ``min_interval`` seconds; the
+    first and the final update are always sent. Rate and ETA are averaged
+    over the items processed since the tracker started.
+    """
+
+    def __init__(
+        self,
+        event: str,
+        room: Optional[str],
+        tracker_id,
+        total: int,
+        processed: int = 0,
+        min_interval: float = 0.0,
+    ):
+        self.event = event
+        self.room = room
+        self.id = tracker_id
+        self.total = total
+        self.processed = processed
+        self.status: Optional[str] = None
+        self.min_interval = min_interval
+        self._started = time.monotonic()
+        self._started_processed = processed
+        self._last_emit: Optional[float] = None
+
+    def advance(self, n: int = 1) -> None:
+        self.update(self.processed + n)
+
+    def update(self, processed: int, status: Optional[str] = None) -> None:
+        self.processed = processed
+        self.status = status or self.status
+        now = time.monotonic()
+        if (
+            self._last_emit is None
+            or self.processed >= self.total
+            or status is not None
+            or now - self._last_emit >= self.min_interval
+        ):
+            self._last_emit = now
+            if self.room is not None:
+                socket.emit(self.event, self.state(), to=self.room)
+
+    def state(self) -> Dict:
+        elapsed = time.monotonic() - self._started
+        done_here = self.processed - self._started_processed
+        rate = done_here / elapsed if elapsed > 0 and done_here > 0 else None
+        remaining = max(self.total - self.processed, 0)
+        return {
+            "id": self.id,
+            "status": self.status,
+            "processed": self.processed,
+            "total": self.total,
+            "percent": _percent(self.processed, self.total),
+            "rate": round(rate, 2) if rate is not None else None,
+            "eta_seconds": round(remaining / rate, 1) if rate else None,
+        }
+
+
+class Progress:
+    """Scoped progress events of jobs and uploads over Socket.IO.
+
+    Job progress goes to the room of the job, which the owner's clients
+    join on connect (or with a ``watch job`` event); upload progress goes
+    to the room of the uploading user. A client that (re)connects is sent
+    the current state of the jobs it joins.
+    """
+
+    def __init__(self, app=None):
+        self._jobs: Dict[int, ProgressTracker] = {}
+        self._lock = threading.Lock()
+        self.min_interval = 1 / DEFAULT_PROGRESS_MAX_RATE
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        max_rate = app.config.setdefault("PROGRESS_MAX_RATE", DEFAULT_PROGRESS_MAX_RATE)
+        self.min_interval = 1 / max_rate if max_rate else 0.0
+        socket.on_event("connect", self._on_connect)
+        socket.on_event("watch job", self._on_watch_job)
+        app.extensions["progress"] = self
+
+    def start_job(self, job: Job) -> None:
+        tracker = ProgressTracker(
+            JOB_PROGRESS_EVENT,
+            job_room(job.id),
+            job.id,
+            job.total,
+            processed=job.processed,
+            min_interval=self.min_interval,
+        )
+        with self._lock:
+            self._jobs[job.id] = tracker
+        tracker.update(job.processed, job.status)
+
+    def update_job(self, job: Job) -> None:
+        with self._lock:
+            tracker = self._jobs.get(job.id)
+        if tracker is not None:
+            tracker.update(job.processed)
+
+    def finish_job(self, job: Job) -> None:
+        with self._lock:
+            tracker = self._jobs.pop(job.id, None)
+        if tracker is not None:
+            tracker.update(job.processed, job.status)
+
+    def start_upload(self, total: int) -> ProgressTracker:
+        # Only a signed-in user has a room to send the progress to.
+        room = user_room(current_user.id) if current_user.is_authenticated else None
+        return ProgressTracker(
+            UPLOAD_PROGRESS_EVENT,
+            room,
+            uuid.uuid4().hex,
+            total,
+            min_interval=self.min_interval,
+        )
+
+    def _job_state(self, job: Job) -> Dict:
+        with self._lock:
+            tracker = self._jobs.get(job.id)
+        if tracker is not None:
+            return tracker.state()
+        # Not run by this process: the database has everything but the rate.
+        return {
+            "id": job.id,
+            "status": job.status,
+            "processed": job.processed,
+            "total": job.total,
+            "percent": _percent(job.processed, job.total),
+            "rate": None,
+            "eta_seconds": None,
+        }
+
+    def _join_job(self, job: Job) -> None:
+        join_room(job_room(job.id))
+        socket.emit(JOB_PROGRESS_EVENT, self._job_state(job), to=request.sid)
+
+    def _on_connect(self, auth=None):
+        if not current_user.is_authenticated:
+            return
+        join_room(user_room(current_user.id))
+        for job in Job.query.filter(
+            Job.user_id == current_user.id, Job.status.in_(ACTIVE_JOB_STATUSES)
+        ):
+            self._join_job(job)
+
+    def _on_watch_job(self, job_id):
+        if not current_user.is_authenticated:
+            return
+        job = db.session.get(Job, int(job_id))
+        if job is not None and job.user_id == current_user.id:
+            self._join_job(job)
+
+
+def _percent(processed: int, total: int) -> float:
+    return round(100 * processed / total, 1) if total else 100.0
+
+
+progress = Progress()
@@ -1,15 +1,9 @@
-import csv
-import json
-import math
 import os
-import shutil
-import tempfile
-import time
+import uuid
+from collections import Counter
 from datetime import datetime
+from typing import Dict, Optional, Tuple
 
-import pandas as pd
-import plotly
-import plotly.express as px
 from flask import (
     Blueprint,
     render_template,
@@ -18,27 +12,89 @@ from flask import (
     redirect,
     url_for,
     session,
-    send_file,
+    send_from_directory,
+    jsonify,
+    abort,
+    current_app,
+    Response,
+    stream_with_context,
 )
-from ultralytics import YOLO
+from flask_login import current_user
+from PIL import Image as PILImage
+from sqlalchemy import func, tuple_
+from werkzeug.utils import safe_join
 
-from . import socket, db
-from .models import Image, Stats, MlModels, Batch
+from . import db
+from .annotations import (
+    ANNOTATION_MIMETYPE,
+    annotation_cache,
+    annotation_cache_key,
+    detection_to_dict,
+    get_detections,
+    render_annotated_image,
+)
+from .backends import BACKEND_AUTO, BACKEND_PYTORCH
+from .chart_cache import chart_cache, chart_cache_key
+from .exports import (
+    EXPORT_PARQUET,
+    parquet_available,
+    stream_parquet,
+    stream_yolo_zip,
+)
+from .inference import RUN_FORCE, RUN_NEW, get_images_to_run, resolve_backend
+from .jobs import submit_job, cancel_job, resume_job, job_to_dict
+from .model_registry import model_registry
+from .models import (
+    Image,
+    MlModels,
+    Batch,
+    BatchClassCount,
+    ChunkedUpload,
+    Job,
+    Project,
+)
+from .progress import progress
+from .storage import release_images, remove_files
+from .summary import remove_images_from_summary
+from .thumbnails import (
+    STATIC_DIR,
+    THUMBNAILS_DIR,
+    THUMBNAIL,
+    THUMBNAIL_SIZES,
+    generate_thumbnails,
+    thumbnail_name,
+    thumbnail_path,
+    thumbnail_url,
+)
+from .tiling import TILING_AUTO
+from .uploads import (
+    UPLOAD_CHUNK_SIZE,
+    UPLOAD_TMP_DIR,
+    chunked_upload_path,
+    insert_images,
+    new_image_row,
+    store_upload,
+    store_upload_file,
+)
 from .utils import (
-    load_img_as_np_array,
-    get_annotated_image_from_prediction,
-    get_prediction_stats,
     add_batch_to_db,
+    adjust_batch_image_counts,
+    bump_data_version,
     get_unique_wbc_class_names,
 )
 
 project_views = Blueprint("project_views", __name__)
 IMAGE_TABLE_MAX_ROWS_DISPLAY = 10
+JOBS_MAX_ROWS_DISPLAY = 5
 RUN_TAB = 1
 STATS_TAB = 2
 IMAGE_TAB = 3
-BAR = "Bar"
-PIE = "Pie"
+EXPORT_TAB = 4
+FIRST_PAGE = "first"
+PREV_PAGE = "prev"
+NEXT_PAGE = "next"
+LAST_PAGE = "last"
+THUMBNAIL_MAX_AGE = 365 * 24 * 60 * 60
 
 
 @project_views.route("/project", methods=["GET", "POST"])
@@ -55,94 +111,229 @@ def project():
         session["plot_type"] = request.form.get("plot-type-select")
         session["wbc_class_names"] = request.form.getlist("wbc-class-select")
     project_id = request.args.get("project_id", type=int)
-    page = request.args.get("page", type=int)
     tab = request.args.get("tab", type=int)
     if project_id is not None:
         session["project_id"] = project_id
-    if page is not None:
-        if page < 1:
-            session["image_page"] = 1
-        elif "last_page" in session and page > session["last_page"]:
-            session["image_page"] = session["last_page"]
-        else:
-            session["image_page"] = page
     if tab is not None:
         session["tab"] = tab
 
     return render_template(
         "project.html",
-        images=get_project_images(),
         stats=stats(),
         batches=get_batches(),
         mlmodels=get_ml_models(),
-        wbc_class_names=get_unique_wbc_class_names(),
+        jobs=get_project_jobs(),
+        parquet_available=parquet_available(),
+        wbc_class_names=get_unique_wbc_class_names(session["project_id"]),
     )
 
 
-def get_project_images():
-    images = Image.query.filter_by(
-        project_id=session["project_id"],
-        batch_id=session["batch_id"] if "batch_id" in session else -1,
+@project_views.route("/project/images", methods=["GET"])
+def project_images():
+    batch_id = request.args.get("batch_id", session.get("batch_id", -1), type=int)
+    cursor = request.args.get("cursor")
+    direction = request.args.get("direction", FIRST_PAGE)
+    images, prev_cursor, next_cursor = get_project_images(
+        session["project_id"],
+        batch_id,
+        cursor=decode_image_cursor(cursor) if cursor else None,
+        direction=direction,
     )
-    first_image_on_page = IMAGE_TABLE_MAX_ROWS_DISPLAY * (session["image_page"] - 1)
-    last_image_on_page = first_image_on_page + IMAGE_TABLE_MAX_ROWS_DISPLAY
-    session["total_rows"] = images.count()
-    session["last_page"] = max(
-        math.ceil(images.count() / IMAGE_TABLE_MAX_ROWS_DISPLAY), 1
+    batch = db.session.get(Batch, batch_id)
+    data_version = _project_data_version(session["project_id"])
+    return jsonify(
+        {
+            "images": [image_to_dict(image, data_version) for image in images],
+            "prev_cursor": prev_cursor,
+            "next_cursor": next_cursor,
+            "total": batch.image_count if batch is not None else 0,
+            "page_size": IMAGE_TABLE_MAX_ROWS_DISPLAY,
+        }
     )
-    return images[first_image_on_page:last_image_on_page]
 
 
-def stats():
-    if "batch_stats" in session and "plot_type" in session:
-        images = db.session.query(Image).filter(
-            Image.batch_id.in_(session["batch_stats"]),
-            Image.project_id == session["project_id"],
+def get_project_images(
+    project_id: int,
+    batch_id: int,
+    cursor: Optional[Tuple[datetime, int]] = None,
+    direction: str = FIRST_PAGE,
+):
+    images = Image.query.filter_by(project_id=project_id, batch_id=batch_id)
+    key = tuple_(Image.date, Image.id)
+    backwards = direction in (PREV_PAGE, LAST_PAGE)
+    if cursor is not None and direction in (NEXT_PAGE, PREV_PAGE):
+        images = images.filter(key < cursor if backwards else key > cursor)
+    else:
+        cursor = None
+    if backwards:
+        images = images.order_by(Image.date.desc(), Image.id.desc())
+    else:
+        images = images.order_by(Image.date, Image.id)
+    page = images.limit(IMAGE_TABLE_MAX_ROWS_DISPLAY + 1).all()
+    has_more = len(page) > IMAGE_TABLE_MAX_ROWS_DISPLAY
+    page = page[:IMAGE_TABLE_MAX_ROWS_DISPLAY]
+    has_prev, has_next = (has_more, cursor is not None)
+    if backwards:
+        page.reverse()
+    else:
+        has_prev, has_next = has_next, has_more
+    prev_cursor = encode_image_cursor(page[0]) if page and has_prev else None
+    next_cursor = encode_image_cursor(page[-1]) if page and has_next else None
+    return page, prev_cursor, next_cursor
+
+
+def encode_image_cursor(image: Image) -> str:
+    return f"{image.date.isoformat()}|{image.id}"
+
+
+def decode_image_cursor(cursor: str) -> Tuple[datetime, int]:
+    date, image_id = cursor.rsplit("|", 1)
+    return datetime.fromisoformat(date), int(image_id)
+
+
+def image_to_dict(image: Image, data_version: int) -> Dict:
+    annotated = image.result_model_id is not None or image.annotated_image is not None
+    return {
+        "id": image.id,
+        "name": image.name,
+        "image_url": url_for("static", filename=image.image),
+        "thumbnail_url": thumbnail_url(THUMBNAIL, image.image),
+        "annotated_image_url": url_for(
+            "project_views.annotated_image", image_id=image.id, v=data_version
         )
-        stats_query = (
-            db.session.query(
-                Stats.id,
-                Stats.image_id,
-                Stats.class_name,
-                Image.batch_id,
-                Batch.name.label("batch_name"),
-            )
-            .join(Image, Stats.image_id == Image.id)
-            .join(Batch, Image.batch_id == Batch.id)
-            .filter(Stats.image_id.in_([image.id for image in images]))
-            .filter(
-                Stats.class_name.in_([x.lower() for x in session["wbc_class_names"]])
+        if annotated
+        else None,
+        "annotated_thumbnail_url": url_for(
+            "project_views.annotated_image",
+            image_id=image.id,
+            size=THUMBNAIL,
+            v=data_version,
+        )
+        if annotated
+        else None,
+        "detections_url": url_for("project_views.image_detections", image_id=image.id)
+        if annotated
+        else None,
+        "date": image.date.strftime("%d/%m/%Y | %H:%M:%S"),
+    }
+
+
+@project_views.route("/images/<int:image_id>/annotated", methods=["GET"])
+def annotated_image(image_id):
+    image = _get_project_image(image_id)
+    size = request.args.get("size")
+    if size is not None and size not in THUMBNAIL_SIZES:
+        abort(404)
+    max_side = THUMBNAIL_SIZES.get(size)
+    class_names = request.args.getlist("class")
+    key = annotation_cache_key(
+        image.id, _project_data_version(image.project_id), max_side, class_names
+    )
+    data = annotation_cache.get(key)
+    if data is None:
+        try:
+            data = render_annotated_image(
+                image, get_detections(image.id, class_names), max_side
             )
+        except (OSError, ValueError, PILImage.DecompressionBombError):
+            # E.g. a slide above PIL's pixel limit, which has no preview.
+            current_app.logger.exception("Cannot render annotated %s", image.image)
+            abort(404)
+        annotation_cache.put(key, data)
+    response = Response(data, mimetype=ANNOTATION_MIMETYPE)
+    # URLs carry the project's data version, so a response never goes stale.
+    response.cache_control.private = True
+    response.cache_control.max_age = THUMBNAIL_MAX_AGE
+    return response
+
+
+@project_views.route("/images/<int:image_id>/detections", methods=["GET"])
+def image_detections(image_id):
+    image = _get_project_image(image_id)
+    return jsonify(
+        {
+            "id": image.id,
+            "image_url": url_for("static", filename=image.image),
+            "detections": [
+                detection_to_dict(detection)
+                for detection in get_detections(
+                    image.id, request.args.getlist("class")
+                )
+            ],
+        }
+    )
+
+
+def _get_project_image(image_id: int) -> Image:
+    return Image.query.filter_by(
+        id=image_id, project_id=session["project_id"]
+    ).first_or_404()
+
+
+def _project_data_version(project_id: int) -> int:
+    return (
+        db.session.query(Project.data_version)
+        .filter(Project.id == project_id)
+        .scalar()
+    )
+
+
+@project_views.route("/thumbnail/<size>/<path:filename>", methods=["GET"])
+def thumbnail(size, filename):
+    if size not in THUMBNAIL_SIZES or safe_join(STATIC_DIR, filename) is None:
+        abort(404)
+    if not os.path.exists(thumbnail_path(size, filename)):
+        if not os.path.exists(os.path.join(STATIC_DIR, filename)):
+            abort(404)
+        try:
+            generate_thumbnails(filename)
+        except (OSError, ValueError, PILImage.DecompressionBombError):
+            current_app.logger.exception("Cannot create thumbnails of %s", filename)
+            abort(404)
+    response = send_from_directory(
+        os.path.abspath(os.path.join(THUMBNAILS_DIR, size)),
+        thumbnail_name(filename),
+        max_age=THUMBNAIL_MAX_AGE,
+    )
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+def stats():
+    if "batch_stats" in session and "plot_type" in session:
+        class_names = [x.lower() for x in session["wbc_class_names"]]
+        data_version = _project_data_version(session["project_id"])
+        key = chart_cache_key(
+            session["project_id"],
+            session["batch_stats"],
+            class_names,
+            session["plot_type"],
+            data_version,
         )
-        df = pd.read_sql(stats_query.statement, db.engine)
-        df["count"] = df.groupby(["class_name", "batch_name"])["id"].transform("count")
-        df_for_plot = df.drop_duplicates(subset=["class_name", "batch_name"])
-        if session["plot_type"] == BAR:
-            fig = px.bar(
-                df_for_plot,
-                x="class_name",
-                y="count",
-                color="batch_name",
-                barmode="group",
-                title="WBC class counts",
-                template="plotly",
-                text_auto=True,
+        graphJSON = chart_cache.get(key)
+        if graphJSON is None:
+            from .charts import render_class_counts_chart
+
+            stats_query = (
+                db.session.query(
+                    BatchClassCount.class_name,
+                    Batch.name.label("batch_name"),
+                    func.sum(BatchClassCount.count).label("count"),
+                )
+                .join(Batch, BatchClassCount.batch_id == Batch.id)
+                .filter(
+                    BatchClassCount.project_id == session["project_id"],
+                    BatchClassCount.batch_id.in_(session["batch_stats"]),
+                    BatchClassCount.class_name.in_(class_names),
+                )
+                .group_by(BatchClassCount.class_name, Batch.name)
             )
-            graphJSON = json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder)
-            return graphJSON
-        elif session["plot_type"] == PIE:
-            fig = px.pie(
-                df_for_plot,
-                values="count",
-                names="class_name",
-                facet_col="batch_name",
-                facet_col_wrap=3,
-                title="WBC class counts",
-                template="plotly",
+            graphJSON = render_class_counts_chart(
+                stats_query.all(), session["plot_type"]
             )
-            fig.update_traces(textposition="inside", textinfo="percent+label")
-            graphJSON = json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder)
-            return graphJSON
+            chart_cache.put(key, graphJSON)
+        return graphJSON
     return None
 
 
@@ -170,99 +361,226 @@ def create_batch():
 
 
 @project_views.route("/run", methods=["POST"])
-async def run():
+def run():
     if request.method == "POST":
-        model = YOLO(
-            MlModels.query.filter_by(name=request.form.get("model-select"))
-            .first()
-            .model
-        )
+        ml_model = MlModels.query.filter_by(
+            name=request.form.get("model-select")
+        ).first()
+        if ml_model is None:
+            flash("Choose model to run", category="error")
+            return redirect(url_for("project_views.project", tab=RUN_TAB))
         batch_ids = list(map(int, request.form.getlist("batch-run-select")))
-        images_to_run = db.session.query(Image).filter(
-            Image.batch_id.in_(batch_ids), Image.project_id == session["project_id"]
-        )
-        n_images_to_run = images_to_run.count()
-        if not n_images_to_run:
+        mode = request.form.get("run-mode", RUN_NEW)
+        backend = request.form.get("backend", BACKEND_AUTO)
+        images_to_run = get_images_to_run(session["project_id"], batch_ids)
+        n_images = images_to_run.count()
+        n_images_to_run = n_images
+        if mode != RUN_FORCE and n_images:
+            weights_hash = model_registry.weights_hash(ml_model)
+            model_backend = resolve_backend(ml_model, weights_hash, backend)
+            n_images_to_run = get_images_to_run(
+                session["project_id"],
+                batch_ids,
+                skip_results_of=(
+                    ml_model.id,
+                    weights_hash,
+                    model_backend.backend if model_backend else BACKEND_PYTORCH,
+                ),
+            ).count()
+        if not n_images:
             flash("No images to run model", category="error")
             return redirect(url_for("project_views.project", tab=RUN_TAB))
-        progress_bar_step_size = int(math.ceil(100 / n_images_to_run))
-        progress_bar_step = 0
-        for image in images_to_run:
-            img_array = load_img_as_np_array(image.image)
-            prediction = model.predict(
-                img_array, stream=False, save=False, verbose=False
-            )
-            progress_bar_step += progress_bar_step_size
-            socket.emit("update progress", min(progress_bar_step, 100))
-            annotated_image = get_annotated_image_from_prediction(prediction)
-            annotated_image.save(
-                os.path.join(
-                    "website",
-                    "static",
-                    f"annotated_{image.name}",
-                )
+        if not n_images_to_run:
+            flash(
+                f"All {n_images} images already have results of {ml_model.name}",
+                category="success",
             )
-            image.annotated_image = f"annotated_{image.name}"
-            db.session.commit()
-            prediction_stats = get_prediction_stats(prediction)
-            existing_stats = db.session.query(Stats).filter(Stats.image_id == image.id)
-            if existing_stats is not None:
-                existing_stats.delete()
-                db.session.commit()
-            for class_id, class_name, box_coords in prediction_stats:
-                new_stats = Stats(
-                    image_id=image.id,
-                    class_id=class_id,
-                    class_name=class_name,
-                    box_coords=box_coords,
-                )
-                db.session.add(new_stats)
-                db.session.commit()
-        flash("Model successfully run", category="success")
-        db.session.close()
-    return redirect(url_for("project_views.project", tab=STATS_TAB))
+            return redirect(url_for("project_views.project", tab=RUN_TAB))
+        job = submit_job(
+            user_id=current_user.id if current_user.is_authenticated else None,
+            project_id=session["project_id"],
+            model_id=ml_model.id,
+            batch_ids=batch_ids,
+            total=n_images_to_run,
+            options={
+                "batch_size": request.form.get("batch-size", type=int),
+                "mode": mode,
+                "tiling": request.form.get("tiling", TILING_AUTO),
+                "backend": backend,
+            },
+            cache_hits=n_images - n_images_to_run,
+        )
+        if _wants_json():
+            return jsonify(job_to_dict(job)), 202
+        flash(f"Job #{job.id} queued", category="success")
+    return redirect(url_for("project_views.project", tab=RUN_TAB))
+
+
+@project_views.route("/jobs", methods=["GET"])
+def jobs():
+    return jsonify([job_to_dict(job) for job in get_project_jobs()])
+
+
+@project_views.route("/jobs/<int:job_id>", methods=["GET"])
+def job_status(job_id):
+    return jsonify(job_to_dict(_get_project_job(job_id)))
+
+
+@project_views.route("/jobs/<int:job_id>/cancel", methods=["POST"])
+def job_cancel(job_id):
+    job = _get_project_job(job_id)
+    if not cancel_job(job):
+        return jsonify(job_to_dict(job)), 409
+    return jsonify(job_to_dict(job))
+
+
+@project_views.route("/jobs/<int:job_id>/resume", methods=["POST"])
+def job_resume(job_id):
+    job = _get_project_job(job_id)
+    if not resume_job(job):
+        return jsonify(job_to_dict(job)), 409
+    return jsonify(job_to_dict(job))
+
+
+def get_project_jobs():
+    return (
+        Job.query.filter_by(project_id=session["project_id"])
+        .order_by(Job.id.desc())
+        .limit(JOBS_MAX_ROWS_DISPLAY)
+        .all()
+    )
+
+
+def _get_project_job(job_id: int) -> Job:
+    return Job.query.filter_by(
+        id=job_id, project_id=session["project_id"]
+    ).first_or_404()
+
+
+def _wants_json() -> bool:
+    return (
+        request.accept_mimetypes.accept_json
+        and not request.accept_mimetypes.accept_html
+    )
 
 
 @project_views.route("/upload_images", methods=["POST"])
-async def upload_images():
+def upload_images():
     if "images[]" not in request.files:
         flash("No file part", category="error")
         return redirect(url_for("project_views.project"))
 
     images = request.files.getlist("images[]")
-    progress_bar_step_size = int(math.ceil(100 / len(images)))
-    progress_bar_step = 0
+    upload_progress = progress.start_upload(len(images))
+    image_rows = []
     for image in images:
-        if image.filename == "":
-            flash("No selected file", category="error")
-            continue
-        if image and allowed_file(image.filename):
-            new_image = Image(
-                project_id=session["project_id"],
-                batch_id=session["batch_id"],
-                name=image.filename,
-                image=image.filename,
-                date=datetime.now(),
-            )
-            image.save(
-                os.path.join(
-                    "website",
-                    "static",
-                    image.filename,
-                )
-            )
-            db.session.add(new_image)
-            db.session.commit()
-            progress_bar_step += progress_bar_step_size
-            socket.emit("update upload progress", min(progress_bar_step, 100))
-            time.sleep(0.2)
-        else:
-            flash("Invalid file format", category="error")
-
-    flash("Images uploaded successfully", category="success")
+        image_row = _store_uploaded_image(image)
+        # Counted once the file is stored (or rejected), not before.
+        upload_progress.advance()
+        if image_row is not None:
+            image_rows.append(image_row)
+    insert_images(image_rows)
+    if image_rows:
+        flash("Images uploaded successfully", category="success")
     return redirect(url_for("project_views.project", tab=IMAGE_TAB))
 
 
+def _store_uploaded_image(image) -> Optional[Dict]:
+    if image.filename == "":
+        flash("No selected file", category="error")
+        return None
+    image_path = None
+    if allowed_file(image.filename):
+        image_path = store_upload(image.stream)
+    if image_path is None:
+        flash(f"Invalid file format: {image.filename}", category="error")
+        return None
+    return new_image_row(
+        session["project_id"], session["batch_id"], image.filename, image_path
+    )
+
+
+@project_views.route("/uploads", methods=["POST"])
+def chunked_upload_start():
+    filename = request.json.get("filename", "")
+    size = request.json.get("size")
+    if not allowed_file(filename) or not isinstance(size, int) or size <= 0:
+        return jsonify({"error": "Invalid file"}), 400
+    upload = ChunkedUpload(
+        id=uuid.uuid4().hex,
+        user_id=current_user.id if current_user.is_authenticated else None,
+        project_id=session["project_id"],
+        batch_id=session["batch_id"],
+        filename=filename,
+        size=size,
+        received=0,
+        created_at=datetime.now(),
+    )
+    db.session.add(upload)
+    db.session.commit()
+    os.makedirs(UPLOAD_TMP_DIR, exist_ok=True)
+    open(chunked_upload_path(upload), "wb").close()
+    return jsonify(_chunked_upload_to_dict(upload)), 201
+
+
+@project_views.route("/uploads/<upload_id>", methods=["GET"])
+def chunked_upload_status(upload_id):
+    return jsonify(_chunked_upload_to_dict(_get_chunked_upload(upload_id)))
+
+
+@project_views.route("/uploads/<upload_id>", methods=["PUT"])
+def chunked_upload_append(upload_id):
+    # The row stays locked until the chunk is committed, so a concurrent PUT
+    # of the same upload waits and then sees the new offset (or no upload).
+    upload = _get_chunked_upload(upload_id, for_update=True)
+    if request.args.get("offset", type=int) != upload.received:
+        result = _chunked_upload_to_dict(upload)
+        db.session.rollback()
+        return jsonify(result), 409
+    with open(chunked_upload_path(upload), "r+b") as part:
+        # Drop the bytes of an earlier PUT that broke off before it committed.
+        part.seek(upload.received)
+        part.truncate()
+        while chunk := request.stream.read(UPLOAD_CHUNK_SIZE):
+            chunk = chunk[: upload.size - upload.received]
+            part.write(chunk)
+            upload.received += len(chunk)
+    if upload.received < upload.size:
+        db.session.commit()
+        return jsonify(_chunked_upload_to_dict(upload))
+    # The last chunk: the row stays locked until the upload is deleted with
+    # the insert of its image, so a repeated PUT cannot store it twice.
+    image_path = store_upload_file(chunked_upload_path(upload))
+    result = _chunked_upload_to_dict(upload)
+    if image_path is None:
+        os.remove(chunked_upload_path(upload))
+        db.session.delete(upload)
+        db.session.commit()
+        return jsonify({**result, "error": "Invalid file format"}), 400
+    db.session.delete(upload)
+    insert_images(
+        [new_image_row(upload.project_id, upload.batch_id, upload.filename, image_path)]
+    )
+    return jsonify({**result, "done": True})
+
+
+def _get_chunked_upload(upload_id: str, for_update: bool = False) -> ChunkedUpload:
+    query = ChunkedUpload.query.filter_by(id=upload_id, project_id=session["project_id"])
+    if for_update:
+        query = query.with_for_update()
+    return query.first_or_404()
+
+
+def _chunked_upload_to_dict(upload: ChunkedUpload) -> Dict:
+    return {
+        "id": upload.id,
+        "filename": upload.filename,
+        "size": upload.size,
+        "received": upload.received,
+        "done": False,
+    }
+
+
 def allowed_file(filename):
     return "." in filename and filename.rsplit(".", 1)[1].lower() in {
         "png",
@@ -270,6 +588,7 @@ def allowed_file(filename):
         "jpeg",
         "bmp",
         "tif",
+        "tiff",
     }
 
 
@@ -280,8 +599,20 @@ def delete_image():
         if not image_id_to_delete:
             flash("No images selected", category="error")
         else:
+            remove_images_from_summary(image_id_to_delete)
+            deleted_per_batch = (
+                db.session.query(Image.batch_id, func.count(Image.id))
+                .filter(Image.id.in_(image_id_to_delete))
+                .group_by(Image.batch_id)
+            )
+            adjust_batch_image_counts(
+                Counter({batch_id: -n for batch_id, n in deleted_per_batch})
+            )
+            orphans = release_images(Image.id.in_(image_id_to_delete))
             db.session.query(Image).filter(Image.id.in_(image_id_to_delete)).delete()
+            bump_data_version([session["project_id"]])
             db.session.commit()
+            remove_files(orphans)
             flash("Images successfully deleted", category="success")
     return redirect(url_for("project_views.project", tab=IMAGE_TAB))
 
@@ -289,55 +620,37 @@ def delete_image():
 @project_views.route("/delete_batch", methods=["GET", "POST"])
 def delete_batch():
     if request.method == "POST":
+        db.session.query(BatchClassCount).filter(
+            BatchClassCount.batch_id == session["batch_id"]
+        ).delete()
+        orphans = release_images(Image.batch_id == session["batch_id"])
         db.session.query(Batch).filter(Batch.id == session["batch_id"]).delete()
+        bump_data_version([session["project_id"]])
         db.session.commit()
+        remove_files(orphans)
         flash("Batch successfully deleted", category="success")
     return redirect(url_for("project_views.project", tab=IMAGE_TAB))
 
 
 @project_views.route("/export", methods=["GET", "POST"])
 def export():
-    with tempfile.TemporaryDirectory() as tmp_dir:
-        batch_ids = list(map(int, request.form.getlist("batch-export-select")))
-        export_query = (
-            db.session.query(
-                Stats.id,
-                Stats.class_id,
-                Stats.box_coords,
-                Stats.image_id,
-                Image.image,
-                Image.name,
-                Image.batch_id,
-            )
-            .join(Image, Stats.image_id == Image.id)
-            .filter(Image.batch_id.in_(batch_ids))
-        )
-        df = pd.read_sql(export_query.statement, db.engine)
-        with open(os.path.join(tmp_dir, "classes.txt"), "a") as classes_file:
-            model_names = YOLO(
-                MlModels.query.filter_by(name="best.pt").first().model
-            ).names
-            for names in model_names.values():
-                classes_file.write(f"{names}\n")
-        os.mkdir(os.path.join(tmp_dir, "images"))
-        os.mkdir(os.path.join(tmp_dir, "labels"))
-        for image_path, data in df.groupby("image"):
-            shutil.copy(
-                os.path.join("website", "static", image_path),
-                os.path.join(tmp_dir, "images", image_path),
-            )
-            data[["class_id", "box_coords"]].to_csv(
-                os.path.join(
-                    tmp_dir, "labels", f"{os.path.splitext(image_path)[0]}.txt"
-                ),
-                header=False,
-                index=False,
-                sep=" ",
-                doublequote=False,
-                escapechar=" ",
-                quoting=csv.QUOTE_NONE,
-            )
-        shutil.make_archive(tmp_dir, "zip", tmp_dir)
-        return send_file(
-            f"{tmp_dir}.zip", as_attachment=True, download_name="results.zip"
+    batch_ids = list(map(int, request.form.getlist("batch-export-select")))
+    if request.form.get("export-format") == EXPORT_PARQUET:
+        if not parquet_available():
+            flash("Parquet export requires pyarrow", category="error")
+            return redirect(url_for("project_views.project", tab=EXPORT_TAB))
+        return Response(
+            stream_with_context(stream_parquet(session["project_id"], batch_ids)),
+            mimetype="application/vnd.apache.parquet",
+            headers={"Content-Disposition": "attachment; filename=detections.parquet"},
         )
+    class_names = model_registry.class_names(
+        MlModels.query.filter_by(name="best.pt").first()
+    )
+    return Response(
+        stream_with_context(
+            stream_yolo_zip(session["project_id"], batch_ids, class_names)
+        ),
+        mimetype="application/zip",
+        headers={"Content-Disposition": "attachment; filename=results.zip"},
+    )
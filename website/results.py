@@ -0,0 +1,102 @@
+import csv
+import io
+from collections import Counter
+from typing import Dict, List, Optional, Sequence
+
+from sqlalchemy import insert
+
+from . import db
+from .models import Image, Stats
+from .summary import count_image_classes, apply_class_count_deltas
+from .utils import bump_data_version
+
+STATS_COLUMNS = (
+    "image_id",
+    "model_id",
+    "class_id",
+    "class_name",
+    "x",
+    "y",
+    "w",
+    "h",
+    "confidence",
+)
+
+
+class ResultWriter:
+    """Buffers detections of many images and replaces them in one transaction.
+
+    ``flush`` deletes the previous detections of every buffered image,
+    inserts the new ones with a single multi-row INSERT (or ``COPY`` on
+    PostgreSQL) and updates ``batch_class_count`` by the difference, then
+    commits once.
+    """
+
+    def __init__(self, model_id: int, commit_every: int, use_copy: bool = True):
+        self.model_id = model_id
+        self.commit_every = max(commit_every, 1)
+        self.use_copy = use_copy
+        self._image_ids: List[int] = []
+        self._rows: List[Dict] = []
+        self._class_counts = Counter()
+        self._project_ids = set()
+
+    @property
+    def pending(self) -> int:
+        return len(self._image_ids)
+
+    @property
+    def last_image_id(self) -> Optional[int]:
+        return self._image_ids[-1] if self._image_ids else None
+
+    def is_full(self) -> bool:
+        return self.pending >= self.commit_every
+
+    def add(self, image: Image, prediction_stats: Sequence) -> None:
+        self._image_ids.append(image.id)
+        self._project_ids.add(image.project_id)
+        for row in prediction_stats:
+            record = dict(zip(STATS_COLUMNS, (image.id, self.model_id, *row)))
+            self._rows.append(record)
+            self._class_counts[
+                (image.project_id, image.batch_id, record["class_name"])
+            ] += 1
+
+    def flush(self) -> None:
+        if self._image_ids:
+            class_count_deltas = self._class_counts.copy()
+            class_count_deltas.subtract(count_image_classes(self._image_ids))
+            apply_class_count_deltas(class_count_deltas)
+            bump_data_version(self._project_ids)
+            db.session.query(Stats).filter(
+                Stats.image_id.in_(self._image_ids)
+            ).delete(synchronize_session=False)
+            if self._rows:
+                if self.use_copy and _supports_copy():
+                    _copy_rows(self._rows)
+                else:
+                    db.session.execute(insert(Stats), self._rows)
+        db.session.commit()
+        self._image_ids = []
+        self._rows = []
+        self._class_counts = Counter()
+        self._project_ids = set()
+
+
+def _supports_copy() -> bool:
+    dialect = db.session.get_bind().dialect
+    return dialect.name == "postgresql" and dialect.driver == "psycopg2"
+
+
+def _copy_rows(rows: List[Dict]) -> None:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([row[column] for column in STATS_COLUMNS])
+    buffer.seek(0)
+    cursor = db.session.connection().connection.cursor()
+    cursor.copy_expert(
+        f"COPY {Stats.__tablename__} ({', '.join(STATS_COLUMNS)}) "
+        "FROM STDIN WITH (FORMAT csv)",
+        buffer,
+    )
@@ -0,0 +1,265 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from collections import Counter
+from typing import BinaryIO, Dict, Iterable, List, Optional, Set
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import or_, union_all
+
+from . import db
+from .models import Image, StoredFile
+from .thumbnails import (
+    STATIC_DIR,
+    THUMBNAIL_SIZES,
+    generate_missing_thumbnails,
+    thumbnail_path,
+)
+from .utils import dialect_insert
+
+# Files are stored as store/<h[0:2]>/<h[2:4]>/<sha256>.<ext> relative to the
+# static directory, so Image.image can still be served by url_for("static").
+STORE = "store"
+STORE_DIR = os.path.join(STATIC_DIR, STORE)
+STORE_TMP_DIR = os.path.join(STORE_DIR, "tmp")
+STORE_CHUNK_SIZE = 1024 * 1024
+MIGRATE_COMMIT_EVERY = 500
+
+storage_cli = AppGroup("storage", help="Manage the content-addressed image store.")
+
+
+def stored_path(digest: str, extension: str) -> str:
+    return "/".join((STORE, digest[:2], digest[2:4], f"{digest}.{extension}"))
+
+
+def storage_path(path: str) -> str:
+    return os.path.join(STATIC_DIR, path)
+
+
+def is_stored(path: Optional[str]) -> bool:
+    return path is not None and path.startswith(f"{STORE}/")
+
+
+def put_stream(stream: BinaryIO, extension: str) -> str:
+    os.makedirs(STORE_TMP_DIR, exist_ok=True)
+    digest = hashlib.sha256()
+    with tempfile.NamedTemporaryFile(dir=STORE_TMP_DIR, delete=False) as tmp:
+        while chunk := stream.read(STORE_CHUNK_SIZE):
+            digest.update(chunk)
+            tmp.write(chunk)
+    return _commit_file(tmp.name, digest.hexdigest(), extension)
+
+
+def put_file(path: str, extension: str, keep_original: bool = False) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as source:
+        while chunk := source.read(STORE_CHUNK_SIZE):
+            digest.update(chunk)
+    if keep_original:
+        os.makedirs(STORE_TMP_DIR, exist_ok=True)
+        tmp_path = os.path.join(STORE_TMP_DIR, f"{digest.hexdigest()}.copy")
+        shutil.copyfile(path, tmp_path)
+        path = tmp_path
+    return _commit_file(path, digest.hexdigest(), extension)
+
+
+def _commit_file(tmp_path: str, digest: str, extension: str) -> str:
+    """Moves the file into the store and adds a reference to it.
+
+    The reference is taken (and its row locked) before the stored file is
+    looked for, so ``remove_files`` cannot delete a file this upload reuses.
+    It is committed with the rows that use the file.
+    """
+    path = stored_path(digest, extension)
+    destination = storage_path(path)
+    add_references([path])
+    if os.path.exists(destination):
+        os.remove(tmp_path)
+    else:
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        os.replace(tmp_path, destination)
+        db.session.query(StoredFile).filter(StoredFile.path == path).update(
+            {StoredFile.size: os.path.getsize(destination)}, synchronize_session=False
+        )
+    return path
+
+
+def add_references(paths: Iterable[Optional[str]]) -> None:
+    counts = Counter(path for path in paths if is_stored(path))
+    if not counts:
+        return
+    rows = [
+        {"path": path, "size": _file_size(path), "refcount": n}
+        for path, n in counts.items()
+    ]
+    table = StoredFile.__table__
+    statement = dialect_insert(table)
+    db.session.execute(
+        statement.on_conflict_do_update(
+            index_elements=[table.c.path],
+            set_={"refcount": table.c.refcount + statement.excluded.refcount},
+        ),
+        rows,
+    )
+
+
+def release_references(paths: Iterable[Optional[str]]) -> List[str]:
+    """Drops references and returns the files that are no longer used.
+
+    The returned files must be passed to ``remove_files`` once the
+    transaction is committed.
+    """
+    counts = Counter(path for path in paths if is_stored(path))
+    for path, n in counts.items():
+        db.session.query(StoredFile).filter(StoredFile.path == path).update(
+            {StoredFile.refcount: StoredFile.refcount - n}, synchronize_session=False
+        )
+    orphans = [
+        path
+        for (path,) in db.session.query(StoredFile.path).filter(
+            StoredFile.path.in_(list(counts)), StoredFile.refcount <= 0
+        )
+    ]
+    if orphans:
+        db.session.query(StoredFile).filter(StoredFile.path.in_(orphans)).delete(
+            synchronize_session=False
+        )
+    return orphans
+
+
+def release_images(*criteria) -> List[str]:
+    rows = db.session.query(Image.image, Image.annotated_image).filter(*criteria)
+    return release_references(path for row in rows for path in row)
+
+
+def remove_files(paths: Iterable[str]) -> None:
+    """Deletes files whose last reference was released and committed.
+
+    A stored file is deleted only if it is still unreferenced while its row
+    is locked, as an upload of the same content may have taken a new
+    reference since.
+    """
+    for path in paths:
+        if is_stored(path) and not _lock_unreferenced(path):
+            db.session.commit()
+            continue
+        for file_path in [storage_path(path)] + [
+            thumbnail_path(size, path) for size in THUMBNAIL_SIZES
+        ]:
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                pass
+        if is_stored(path):
+            db.session.query(StoredFile).filter(StoredFile.path == path).delete(
+                synchronize_session=False
+            )
+            db.session.commit()
+
+
+def _lock_unreferenced(path: str) -> bool:
+    # A placeholder row makes a concurrent add_references wait for the
+    # deletion to commit, so it sees that the file has to be stored again.
+    table = StoredFile.__table__
+    db.session.execute(
+        dialect_insert(table)
+        .values(path=path, size=None, refcount=0)
+        .on_conflict_do_nothing(index_elements=[table.c.path])
+    )
+    refcount = (
+        db.session.query(StoredFile.refcount)
+        .filter(StoredFile.path == path)
+        .with_for_update()
+        .scalar()
+    )
+    return refcount <= 0
+
+
+def _file_size(path: str) -> Optional[int]:
+    try:
+        return os.path.getsize(storage_path(path))
+    except OSError:
+        return None
+
+
+def _count_image_references() -> Dict[str, int]:
+    paths = union_all(
+        db.select(Image.image.label("path")),
+        db.select(Image.annotated_image.label("path")),
+    ).subquery()
+    rows = (
+        db.session.query(paths.c.path, db.func.count())
+        .filter(paths.c.path.like(f"{STORE}/%"))
+        .group_by(paths.c.path)
+    )
+    return dict(rows.all())
+
+
+def _recount() -> Set[str]:
+    references = _count_image_references()
+    db.session.query(StoredFile).delete(synchronize_session=False)
+    add_references(Counter(references).elements())
+    db.session.commit()
+    return set(references)
+
+
+@storage_cli.command("migrate")
+@click.option(
+    "--keep-originals", is_flag=True, help="Do not delete the flat files afterwards."
+)
+def migrate(keep_originals: bool):
+    """Move images from the flat static directory into the store."""
+    moved: Dict[str, str] = {}
+    missing = 0
+    rows = db.session.query(Image.id, Image.image, Image.annotated_image).filter(
+        or_(
+            Image.image.notlike(f"{STORE}/%"),
+            Image.annotated_image.notlike(f"{STORE}/%"),
+        )
+    )
+    for i, (image_id, *paths) in enumerate(rows.all(), start=1):
+        values = {}
+        for column, path in zip(("image", "annotated_image"), paths):
+            if path is None or is_stored(path):
+                continue
+            if path not in moved:
+                if not os.path.exists(storage_path(path)):
+                    missing += 1
+                    click.echo(f"Missing file {path} of image {image_id}", err=True)
+                    continue
+                extension = os.path.splitext(path)[1].lstrip(".").lower() or "png"
+                moved[path] = put_file(storage_path(path), extension, keep_original=True)
+                try:
+                    generate_missing_thumbnails(moved[path])
+                except (OSError, ValueError) as error:
+                    click.echo(f"Cannot create thumbnails of {path}: {error}", err=True)
+            values[column] = moved[path]
+        if values:
+            db.session.query(Image).filter(Image.id == image_id).update(values)
+        if i % MIGRATE_COMMIT_EVERY == 0:
+            db.session.commit()
+    db.session.commit()
+    _recount()
+    if not keep_originals:
+        remove_files(moved)
+    click.echo(f"Moved {len(moved)} files into the store, {missing} missing")
+
+
+@storage_cli.command("gc")
+def gc():
+    """Recount references and delete stored files no image uses."""
+    referenced = _recount()
+    removed = []
+    for root, _, files in os.walk(STORE_DIR):
+        if os.path.abspath(root) == os.path.abspath(STORE_TMP_DIR):
+            continue
+        for name in files:
+            path = "/".join(
+                (STORE, *os.path.relpath(os.path.join(root, name), STORE_DIR).split(os.sep))
+            )
+            if path not in referenced:
+                removed.append(path)
+    remove_files(removed)
+    click.echo(f"Removed {len(removed)} unreferenced files")
@@ -0,0 +1,50 @@
+from collections import Counter
+from typing import Iterable
+
+from sqlalchemy import func
+
+from . import db
+from .models import BatchClassCount, Image, Stats
+from .utils import dialect_insert
+
+# Per (project_id, batch_id, class_name) change of the number of detections.
+ClassCountDeltas = Counter
+
+
+def count_image_classes(image_ids: Iterable[int]) -> ClassCountDeltas:
+    rows = (
+        db.session.query(
+            Image.project_id, Image.batch_id, Stats.class_name, func.count(Stats.id)
+        )
+        .join(Image, Stats.image_id == Image.id)
+        .filter(Stats.image_id.in_(image_ids))
+        .group_by(Image.project_id, Image.batch_id, Stats.class_name)
+    )
+    return Counter({(p, b, c): n for p, b, c, n in rows})
+
+
+def apply_class_count_deltas(deltas: ClassCountDeltas) -> None:
+    rows = [
+        {"project_id": p, "batch_id": b, "class_name": c, "count": n}
+        for (p, b, c), n in deltas.items()
+        if n
+    ]
+    if not rows:
+        return
+    table = BatchClassCount.__table__
+    statement = dialect_insert(table)
+    db.session.execute(
+        statement.on_conflict_do_update(
+            index_elements=[table.c.batch_id, table.c.class_name],
+            set_={"count": table.c.count + statement.excluded.count},
+        ),
+        rows,
+    )
+    db.session.query(BatchClassCount).filter(BatchClassCount.count <= 0).delete(
+        synchronize_session=False
+    )
+
+
+def remove_images_from_summary(image_ids: Iterable[int]) -> None:
+    deltas = count_image_classes(image_ids)
+    apply_class_count_deltas(Counter({key: -n for key, n in deltas.items()}))
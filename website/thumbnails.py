@@ -0,0 +1,91 @@
+import os
+from typing import Optional
+
+import click
+import numpy as np
+from flask import url_for
+from flask.cli import AppGroup
+from PIL import Image as PILImage, features
+
+from . import db
+from .models import Image
+
+STATIC_DIR = os.path.join("website", "static")
+THUMBNAILS_DIR = os.path.join(STATIC_DIR, "thumbnails")
+THUMBNAIL = "thumb"
+PREVIEW = "preview"
+THUMBNAIL_SIZES = {THUMBNAIL: 128, PREVIEW: 1024}
+THUMBNAIL_FORMAT, THUMBNAIL_EXTENSION = (
+    ("WEBP", "webp") if features.check("webp") else ("JPEG", "jpg")
+)
+
+thumbnails_cli = AppGroup("thumbnails", help="Manage image thumbnails and previews.")
+
+
+def thumbnail_name(image_path: str) -> str:
+    return f"{image_path}.{THUMBNAIL_EXTENSION}"
+
+
+def thumbnail_path(size: str, image_path: str) -> str:
+    return os.path.join(THUMBNAILS_DIR, size, thumbnail_name(image_path))
+
+
+def generate_thumbnails(image_path: str) -> None:
+    with PILImage.open(os.path.join(STATIC_DIR, image_path)) as original:
+        largest = max(THUMBNAIL_SIZES.values())
+        # JPEG can decode straight at a reduced scale, which skips most of
+        # the work for large smears.
+        original.draft("RGB", (largest, largest))
+        original = to_rgb(original)
+        for size, max_side in sorted(
+            THUMBNAIL_SIZES.items(), key=lambda item: item[1], reverse=True
+        ):
+            original.thumbnail((max_side, max_side))
+            path = thumbnail_path(size, image_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            original.save(path, THUMBNAIL_FORMAT, quality=80)
+
+
+def generate_missing_thumbnails(image_path: str) -> bool:
+    if all(
+        os.path.exists(thumbnail_path(size, image_path)) for size in THUMBNAIL_SIZES
+    ):
+        return False
+    generate_thumbnails(image_path)
+    return True
+
+
+def thumbnail_url(size: str, image_path: str) -> str:
+    try:
+        version = int(os.path.getmtime(os.path.join(STATIC_DIR, image_path)))
+    except OSError:
+        version = 0
+    return url_for("project_views.thumbnail", size=size, filename=image_path, v=version)
+
+
+def to_rgb(image: PILImage.Image) -> PILImage.Image:
+    if image.mode.startswith("I") or image.mode == "F":
+        # 16/32-bit microscopy TIFFs: stretch to 8 bits for display.
+        array = np.asarray(image, dtype=np.float32)
+        image = PILImage.fromarray(
+            (array * (255 / max(float(array.max()), 1.0))).astype(np.uint8)
+        )
+    return image.convert("RGB")
+
+
+@thumbnails_cli.command("backfill")
+@click.option("--project-id", type=int, default=None, help="Only this project.")
+def backfill(project_id: Optional[int]):
+    """Generate missing thumbnails and previews for stored images."""
+    images = db.session.query(Image.image, Image.annotated_image)
+    if project_id is not None:
+        images = images.filter(Image.project_id == project_id)
+    generated = failed = 0
+    for row in images.yield_per(500):
+        for image_path in filter(None, row):
+            try:
+                generated += generate_missing_thumbnails(image_path)
+            except (OSError, ValueError) as error:
+                failed += 1
+                click.echo(f"Skipping {image_path}: {error}", err=True)
+    click.echo(f"Generated thumbnails for {generated} images, {failed} failed")
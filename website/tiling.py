@@ -0,0 +1,178 @@
+import threading
+from contextlib import contextmanager
+from typing import Iterator, List, Tuple
+
+import numpy as np
+from PIL import Image as PILImage
+
+from .storage import storage_path
+from .utils import get_detection_stats
+
+TILING_AUTO = "auto"
+TILING_ALWAYS = "always"
+TILING_NEVER = "never"
+TIFF_EXTENSIONS = (".tif", ".tiff")
+
+TileBox = Tuple[int, int, int, int]
+
+_unbounded_lock = threading.Lock()
+
+
+@contextmanager
+def _open_unbounded(path: str) -> Iterator[PILImage.Image]:
+    """Opens a stored image of any size with PIL.
+
+    The decompression bomb check guards uploads; slides above its limit are
+    what tiling is for. The check is only skipped while the header is read.
+    """
+    with _unbounded_lock:
+        max_pixels = PILImage.MAX_IMAGE_PIXELS
+        PILImage.MAX_IMAGE_PIXELS = None
+        try:
+            image = PILImage.open(path)
+        finally:
+            PILImage.MAX_IMAGE_PIXELS = max_pixels
+    with image:
+        yield image
+
+
+def image_pixels(image_path: str) -> int:
+    path = storage_path(image_path)
+    if path.lower().endswith(TIFF_EXTENSIONS):
+        try:
+            import tifffile
+        except ImportError:
+            pass
+        else:
+            with tifffile.TiffFile(path) as tiff:
+                page = tiff.pages[0]
+                return page.imagelength * page.imagewidth
+    with _open_unbounded(path) as image:
+        return image.width * image.height
+
+
+def use_tiling(image_path: str, tiling: str, min_pixels: int) -> bool:
+    if tiling == TILING_AUTO:
+        return image_pixels(image_path) >= min_pixels
+    return tiling == TILING_ALWAYS
+
+
+def open_image_array(image_path: str) -> np.ndarray:
+    """Returns the pixels of the image, memory-mapped where possible.
+
+    Uncompressed TIFFs are mapped directly and compressed ones are decoded
+    into a temporary memory-mapped file, so tiles are read from disk
+    instead of holding the whole slide in RAM. Both need ``tifffile``;
+    other formats (and TIFFs without it) are decoded completely by PIL,
+    whatever their size.
+    """
+    path = storage_path(image_path)
+    if path.lower().endswith(TIFF_EXTENSIONS):
+        try:
+            import tifffile
+        except ImportError:
+            pass
+        else:
+            try:
+                return tifffile.memmap(path, mode="r")
+            except ValueError:
+                with tifffile.TiffFile(path) as tiff:
+                    return tiff.pages[0].asarray(out="memmap")
+    with _open_unbounded(path) as image:
+        return np.asarray(image)
+
+
+def tile_boxes(width: int, height: int, tile_size: int, overlap: int) -> List[TileBox]:
+    stride = max(tile_size - overlap, 1)
+    return [
+        (left, top, min(left + tile_size, width), min(top + tile_size, height))
+        for top in _tile_starts(height, tile_size, stride)
+        for left in _tile_starts(width, tile_size, stride)
+    ]
+
+
+def _tile_starts(length: int, tile_size: int, stride: int) -> List[int]:
+    if length <= tile_size:
+        return [0]
+    starts = list(range(0, length - tile_size, stride))
+    starts.append(length - tile_size)
+    return starts
+
+
+def tile_to_rgb(tile: np.ndarray) -> np.ndarray:
+    if tile.dtype != np.uint8:
+        if np.issubdtype(tile.dtype, np.integer):
+            scale = 255 / np.iinfo(tile.dtype).max
+        else:
+            scale = 255.0
+        tile = np.clip(tile * scale, 0, 255).astype(np.uint8)
+    if tile.ndim == 2:
+        tile = tile[..., np.newaxis]
+    if tile.shape[2] == 1:
+        tile = np.repeat(tile, 3, axis=2)
+    return np.ascontiguousarray(tile[..., :3])
+
+
+def iter_tiles(
+    array: np.ndarray, boxes: List[TileBox], batch_size: int
+) -> Iterator[Tuple[List[TileBox], List[np.ndarray]]]:
+    for start in range(0, len(boxes), batch_size):
+        chunk = boxes[start : start + batch_size]
+        yield chunk, [
+            tile_to_rgb(array[top:bottom, left:right])
+            for left, top, right, bottom in chunk
+        ]
+
+
+def predict_tiled(
+    model,
+    predict_lock,
+    image_path: str,
+    tile_size: int,
+    overlap: int,
+    batch_size: int,
+    iou_threshold: float,
+) -> List[Tuple]:
+    """Detects on overlapping tiles and merges the boxes across seams.
+
+    Returns rows like ``get_prediction_stats`` with boxes normalized to
+    the full image.
+    """
+    import torch
+    from torchvision.ops import batched_nms
+
+    array = open_image_array(image_path)
+    height, width = array.shape[:2]
+    xyxy, confidences, class_ids = [], [], []
+    names = {}
+    for chunk, tiles in iter_tiles(
+        array, tile_boxes(width, height, tile_size, overlap), batch_size
+    ):
+        with predict_lock:
+            predictions = model.predict(tiles, stream=False, save=False, verbose=False)
+        for (left, top, _, _), prediction in zip(chunk, predictions):
+            names = prediction.names
+            boxes = prediction.boxes.cpu()
+            xyxy.append(boxes.xyxy + torch.tensor([left, top, left, top]))
+            confidences.append(boxes.conf)
+            class_ids.append(boxes.cls)
+    if not xyxy:
+        return []
+    xyxy = torch.cat(xyxy).float()
+    confidences = torch.cat(confidences).float()
+    class_ids = torch.cat(class_ids).int()
+    # Cells on a seam are found in both tiles; class-aware NMS keeps one.
+    keep = batched_nms(xyxy, confidences, class_ids, iou_threshold)
+    xyxy, confidences, class_ids = xyxy[keep], confidences[keep], class_ids[keep]
+    xywhn = torch.stack(
+        [
+            (xyxy[:, 0] + xyxy[:, 2]) / 2 / width,
+            (xyxy[:, 1] + xyxy[:, 3]) / 2 / height,
+            (xyxy[:, 2] - xyxy[:, 0]) / width,
+            (xyxy[:, 3] - xyxy[:, 1]) / height,
+        ],
+        dim=1,
+    )
+    return get_detection_stats(
+        names, class_ids.tolist(), xywhn.tolist(), confidences.tolist()
+    )
@@ -0,0 +1,118 @@
+import os
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import BinaryIO, Dict, List, Optional
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from PIL import Image as PILImage
+from sqlalchemy import insert
+
+from . import db
+from .models import ChunkedUpload, Image
+from .storage import put_file, put_stream
+from .thumbnails import generate_missing_thumbnails
+from .utils import adjust_batch_image_counts, bump_data_version
+
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+UPLOAD_TMP_DIR = os.path.join("website", "uploads_tmp")
+DEFAULT_UPLOAD_MAX_IDLE_HOURS = 24
+IMAGE_SIGNATURES = {
+    b"\x89PNG\r\n\x1a\n": "png",
+    b"\xff\xd8\xff": "jpeg",
+    b"BM": "bmp",
+    b"II*\x00": "tiff",
+    b"MM\x00*": "tiff",
+}
+IMAGE_HEADER_SIZE = max(len(signature) for signature in IMAGE_SIGNATURES)
+
+uploads_cli = AppGroup("uploads", help="Manage resumable uploads.")
+
+
+def sniff_image_format(header: bytes) -> Optional[str]:
+    for signature, image_format in IMAGE_SIGNATURES.items():
+        if header.startswith(signature):
+            return image_format
+    return None
+
+
+def store_upload(stream: BinaryIO) -> Optional[str]:
+    image_format = sniff_image_format(stream.read(IMAGE_HEADER_SIZE))
+    if image_format is None:
+        return None
+    stream.seek(0)
+    return put_stream(stream, image_format)
+
+
+def store_upload_file(path: str) -> Optional[str]:
+    with open(path, "rb") as stream:
+        image_format = sniff_image_format(stream.read(IMAGE_HEADER_SIZE))
+    if image_format is None:
+        return None
+    return put_file(path, image_format)
+
+
+def chunked_upload_path(upload: ChunkedUpload) -> str:
+    return os.path.join(UPLOAD_TMP_DIR, f"{upload.id}.part")
+
+
+def new_image_row(project_id: int, batch_id: int, filename: str, image_path: str) -> Dict:
+    try:
+        generate_missing_thumbnails(image_path)
+    except (OSError, ValueError, PILImage.DecompressionBombError):
+        # The thumbnail route retries on first request; a broken preview
+        # must not fail the upload itself.
+        current_app.logger.exception("Cannot create thumbnails of %s", image_path)
+    return {
+        "project_id": project_id,
+        "batch_id": batch_id,
+        "name": filename,
+        "image": image_path,
+        "date": datetime.now(),
+    }
+
+
+def insert_images(image_rows: List[Dict]) -> None:
+    if not image_rows:
+        return
+    # The references to the stored files were taken when they were stored.
+    db.session.execute(insert(Image), image_rows)
+    adjust_batch_image_counts(Counter(row["batch_id"] for row in image_rows))
+    bump_data_version({row["project_id"] for row in image_rows})
+    db.session.commit()
+
+
+@uploads_cli.command("cleanup")
+@click.option(
+    "--max-idle-hours",
+    type=float,
+    default=DEFAULT_UPLOAD_MAX_IDLE_HOURS,
+    help="Remove uploads that received nothing for longer.",
+)
+def cleanup(max_idle_hours: float):
+    """Delete abandoned resumable uploads and their partial files."""
+    cutoff = datetime.now() - timedelta(hours=max_idle_hours)
+    removed = set()
+    for upload in ChunkedUpload.query.filter(ChunkedUpload.created_at < cutoff):
+        # Every chunk touches the part file, so its mtime is the last activity.
+        path = chunked_upload_path(upload)
+        if not os.path.exists(path) or _modified_at(path) < cutoff:
+            db.session.delete(upload)
+            removed.add(path)
+    db.session.commit()
+    known = {f"{upload_id}.part" for (upload_id,) in db.session.query(ChunkedUpload.id)}
+    if os.path.isdir(UPLOAD_TMP_DIR):
+        # Parts whose upload row is gone, e.g. with its project.
+        for name in os.listdir(UPLOAD_TMP_DIR):
+            path = os.path.join(UPLOAD_TMP_DIR, name)
+            if name not in known and _modified_at(path) < cutoff:
+                removed.add(path)
+    for path in removed:
+        if os.path.exists(path):
+            os.remove(path)
+    click.echo(f"Removed {len(removed)} abandoned uploads")
+
+
+def _modified_at(path: str) -> datetime:
+    return datetime.fromtimestamp(os.path.getmtime(path))
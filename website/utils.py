@@ -1,13 +1,14 @@
-import os
+from collections import Counter
 from datetime import datetime
-from typing import List
+from contextlib import nullcontext
+from typing import Iterable, Iterator, List, Optional, Tuple, Union
 
 import numpy as np
-from PIL import Image as PILImage
 from flask_login import current_user
+from sqlalchemy.dialects import postgresql, sqlite
 
 from website import db
-from website.models import Project, Batch, Stats
+from website.models import Project, Batch, BatchClassCount, Image
 
 
 def get_user_projects():
@@ -33,25 +34,107 @@ def add_batch_to_db(project_id: int, batch_name: str):
     db.session.commit()
 
 
-def load_img_as_np_array(image_path: str) -> np.array:
-    return np.array(PILImage.open(os.path.join("website", "static", image_path)))
+def dialect_insert(table):
+    """INSERT of the session's dialect, for ``on_conflict_do_*`` upserts."""
+    dialect = db.session.get_bind().dialect.name
+    insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+    return insert(table)
 
 
-def get_annotated_image_from_prediction(prediction) -> PILImage.Image:
-    return PILImage.fromarray(prediction[0].plot()[..., ::-1])
+def bump_data_version(project_ids: Iterable[int]) -> None:
+    db.session.query(Project).filter(Project.id.in_(list(project_ids))).update(
+        {Project.data_version: Project.data_version + 1}, synchronize_session=False
+    )
+
 
+def adjust_batch_image_counts(deltas: Counter) -> None:
+    for batch_id, delta in deltas.items():
+        db.session.query(Batch).filter(Batch.id == batch_id).update(
+            {Batch.image_count: Batch.image_count + delta}, synchronize_session=False
+        )
+
+
+def iter_image_batches(
+    images: Iterable[Tuple[Image, Optional[np.array]]],
+    batch_size: int,
+    max_pixels: Optional[int] = None,
+) -> Iterator[List[Tuple[Image, Optional[np.array]]]]:
+    # Images without an array (e.g. tiled ones) are yielded alone, in order
+    # with the other batches.
+    batch: List[Tuple[Image, np.array]] = []
+    batch_pixels = 0
+    for image, img_array in images:
+        if img_array is None:
+            if batch:
+                yield batch
+                batch, batch_pixels = [], 0
+            yield [(image, None)]
+            continue
+        img_pixels = img_array.shape[0] * img_array.shape[1]
+        if batch and max_pixels is not None and batch_pixels + img_pixels > max_pixels:
+            yield batch
+            batch, batch_pixels = [], 0
+        batch.append((image, img_array))
+        batch_pixels += img_pixels
+        if len(batch) >= batch_size:
+            yield batch
+            batch, batch_pixels = [], 0
+    if batch:
+        yield batch
+
+
+def error_message(error: Exception) -> str:
+    return f"{type(error).__name__}: {error}"
+
+
+def predict_arrays(
+    model, img_arrays: List[np.array], predict_lock=nullcontext()
+) -> List[Union[List[Tuple], str]]:
+    """Returns the detections of each image or the error it failed with.
+
+    A batch that fails is predicted again image by image, so one bad image
+    does not cost the others their results.
+    """
+    try:
+        with predict_lock:
+            predictions = model.predict(
+                img_arrays, stream=False, save=False, verbose=False
+            )
+    except Exception as error:
+        if len(img_arrays) == 1:
+            return [error_message(error)]
+        return [
+            stats
+            for img_array in img_arrays
+            for stats in predict_arrays(model, [img_array], predict_lock)
+        ]
+    return list(map(get_prediction_stats, predictions))
+
+
+def get_prediction_stats(prediction) -> List[Tuple]:
+    boxes = prediction.boxes
+    return get_detection_stats(
+        prediction.names,
+        boxes.cls.int().tolist(),
+        boxes.xywhn.tolist(),
+        boxes.conf.tolist(),
+    )
 
-def get_prediction_stats(prediction):
-    classes_id_to_names_map = prediction[0].names
-    prediction_class_ids = prediction[0].boxes.cls
-    stats: List = []
-    for n, prediction_class_id in enumerate(prediction_class_ids):
-        class_name = classes_id_to_names_map[int(prediction_class_id)].replace(" ", "_").lower()
-        box_coords_tensor = prediction[0].boxes.xywhn[n]
-        box_coords_str = " ".join([str(float(x)) for x in box_coords_tensor])
-        stats.append([int(prediction_class_id), class_name, box_coords_str])
-    return stats
 
+def get_detection_stats(names, class_ids, xywhn, confidences) -> List[Tuple]:
+    class_names = {
+        class_id: name.replace(" ", "_").lower() for class_id, name in names.items()
+    }
+    return [
+        (class_id, class_names[class_id], *box_coords, confidence)
+        for class_id, box_coords, confidence in zip(class_ids, xywhn, confidences)
+    ]
 
-def get_unique_wbc_class_names():
-    return [x[0].capitalize() for x in db.session.query(Stats.class_name).distinct()]
+
+def get_unique_wbc_class_names(project_id: int):
+    class_names = (
+        db.session.query(BatchClassCount.class_name)
+        .filter(BatchClassCount.project_id == project_id)
+        .distinct()
+    )
+    return [x[0].capitalize() for x in class_names]
@@ -0,0 +1,9 @@
+from website import create_app, start_warm_up, uses_dev_secret_key
+from website.jobs import job_workers
+
+# Production entry point: gunicorn -c gunicorn.conf.py wsgi:app
+app = create_app()
+if uses_dev_secret_key(app):
+    raise RuntimeError("Set WBC_SECRET_KEY to a random secret before starting the server")
+job_workers.start()
+start_warm_up(app)